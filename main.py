@@ -2,14 +2,35 @@
 import discord
 import asyncio
 import os
+import sys
 import json
+import copy
+import gzip
+import time
+import hashlib
+import heapq
+import weakref
+import contextlib
+from bisect import bisect_left, insort
 import random
+import re
 import string
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field as dc_field
 from datetime import datetime, timedelta, timezone
 from discord.ext import commands
 from discord import app_commands, Interaction, TextChannel, Member
 from discord.ui import View, Button, Modal, TextInput, Select
 
+try:
+    import orjson  # اختیاری؛ سریال‌سازی چند برابر سریع‌تر
+except ImportError:
+    orjson = None
+
+import numpy as np  # ستون‌های کیف پول و اجرای برداری سیاست‌های اقتصادی
+
 # -------------------------
 # تنظیمات و بارگذاری توکن
 # -------------------------
@@ -24,69 +45,47 @@ intents.voice_states = True
 class MyBot(commands.Bot):
 
     async def setup_hook(self):
-        # اینجا تابع بررسی اشتراک‌ها رو موقع آماده شدن ربات اجرا می‌کنیم
-        self.loop.create_task(check_subscriptions_loop())
+        # زمان‌بند انقضای اشتراک‌ها و رول‌ها
+        scheduler.start()
+
+    async def close(self):
+        # ذخیره‌ی تغییرات در صف پیش از خاموش شدن
+        try:
+            voice_tracker.close_all()
+            store.rewards.commit()
+            await store.flush()
+        except Exception as e:
+            print("⚠️ final flush failed:", e)
+        await super().close()
 
 
 bot = MyBot(command_prefix="!", intents=intents)
 
 DATA_FILE = "data.json"
 STREAM_FILE = "stream.json"
-file_lock = asyncio.Lock()
-stream_lock = asyncio.Lock()
 
 # -------------------------
 # Data helpers (robust)
 # -------------------------
-DATA_FILE = "data.json"
-file_lock = asyncio.Lock()
-
-
-def ensure_data_file():
-    default = {
-        "wallet": {},
-        "subscription": {},
-        "warns": {},
-        "badges": {},
-        "contests": {},
-        "server_settings": {},
-        "shoprole": {},
-        "orders": []
-    }
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(default, f, ensure_ascii=False, indent=2)
-        return default
-
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception:
-        # اگر فایل خراب بود، با مقدار پیش‌فرض بازنویسی می‌کنیم
-        data = default
+DATA_DEFAULTS = {
+    "wallet": {},
+    "subscription": {},
+    "warns": {},
+    "badges": {},
+    "contests": {},
+    "server_settings": {},
+    "shoprole": {},
+    "reactions": {},
+    "reactions_floor": 0,
+    "history": {},
+    "last_active": {},
+    "economy_last_run": 0,
+    "telemetry": [],
+    "scheduled_jobs": {},
+    "timers": {},
+    "orders": []
+}
 
-    # بررسی کلیدهای ضروری
-    for k, v in default.items():
-        if k not in data:
-            data[k] = v
-
-    return data
-
-
-def load_data():
-    return ensure_data_file()
-
-
-
-
-async def update_data_runtime():
-    # convenience wrapper if you want to save runtime copies
-    d = load_data()
-    await save_data_async(d)
-
-
-# runtime caches (kept minimal)
-data_cache = load_data()
 
 
 # -------------------------
@@ -108,41 +107,74 @@ def is_admin_member(member: discord.Member) -> bool:
 # -------------------------
 # بارگذاری و ذخیره داده‌ها (async-safe)
 # -------------------------
+def encode_record(obj):
+    # رکوردهای فشرده (Streamer, ShopRole, ...) فقط موقع ذخیره به JSON تبدیل می‌شوند
+    if isinstance(obj, Record):
+        return obj.to_json()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
 
 
-def load_data():
-    with open("data.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+def dumps_json(obj) -> bytes:
+    # orjson اگر نصب باشد، وگرنه json فشرده (بدون indent تا انکودر C استفاده شود)
+    # کلیدهای عددی (user id) در هر دو حالت به رشته تبدیل می‌شوند
+    if orjson is not None:
+        return orjson.dumps(obj,
+                            default=encode_record,
+                            option=orjson.OPT_NON_STR_KEYS
+                            | orjson.OPT_PASSTHROUGH_DATACLASS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"),
+                      default=encode_record).encode("utf-8")
 
 
-async def save_data(data):
-    with open("data.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def loads_json(blob):
+    if orjson is not None:
+        return orjson.loads(blob)
+    return json.loads(blob)
 
 
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {}
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+def atomic_write(file_path, blob: bytes):
+    """temp file + fsync + rename: کرش هیچ‌وقت فایل نصفه باقی نمی‌گذارد."""
+    tmp = f"{file_path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file_path)
+
+
+def append_fsync(file_path, blob: bytes):
+    """افزودن به انتهای فایل و fsync (ژورنال و بایگانی)."""
+    with open(file_path, "ab") as f:
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class CorruptDataError(Exception):
+    """A data file exists but can't be read; the bot must not start empty."""
 
 
 def load_json(file_path):
     if not os.path.exists(file_path):
         return {}
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+        with open(file_path, "rb") as f:
+            return loads_json(f.read())
+    except Exception as e:
+        # شروع با داده‌ی خالی یعنی بازنویسی کل اقتصاد در اولین ذخیره
+        raise CorruptDataError(
+            f"{file_path} خوانا نبود ({e}). ربات اجرا نمی‌شود؛ با "
+            f"python main.py restore <snapshot> از بکاپ بازسازی کنید.") from e
 
 
 def save_json(file_path, data):
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    atomic_write(file_path, dumps_json(data))
+
+
+# همه‌ی نوشتن‌های فایل (سریال‌سازی + fsync + rename) در این ترد انجام می‌شوند.
+# dumps_json تقریباً تماماً در C اجرا می‌شود و داده کپی نمی‌شود؛ اگر تغییری
+# هم‌زمان با سریال‌سازی رخ دهد، همان تغییر dirty است و در flush بعدی نوشته می‌شود.
+io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-io")
 
 
 def generate_invite_code(length=6):
@@ -150,44 +182,1973 @@ def generate_invite_code(length=6):
         random.choices(string.ascii_uppercase + string.digits, k=length))
 
 
-# داده‌ها
-data = load_json(DATA_FILE)  # موجودی و پول استریمرها
-data_cache = data  # هماهنگ‌سازی اولیه
-stream_data = load_json(STREAM_FILE)  # اطلاعات استریمرها
+# -------------------------
+# رکوردهای فشرده در حافظه
+# -------------------------
+# داخل برنامه: کلیدها user id عددی، زمان‌ها epoch (ثانیه) و رکوردها با __slots__.
+# تبدیل به/از رشته فقط در مرز ذخیره‌سازی (encode_record / decode_docs).
+DAY = 86400
+SUB_DAYS = 30
+
+
+def now_ts() -> int:
+    return int(time.time())
+
+
+def to_epoch(value) -> int:
+    """epoch یا رشته‌ی ISO قدیمی -> epoch (فقط در مهاجرت‌ها)"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if value:
+        return int(datetime.fromisoformat(value).timestamp())
+    return 0
+
+
+class Record:
+    __slots__ = ()
+
+    def to_json(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_json(cls, raw):
+        return cls(**raw)
+
+
+@dataclass(slots=True)
+class Streamer(Record):
+    banner_url: str = ""
+    invite_link: str = ""
+    stream_link: str = ""
+    streams_count: int = 0
+    violations: int = 0
+    money: int = 0
+    invite_count: int = 0
+    start_ts: int = 0
+    invite_code: str = None
+
+
+@dataclass(slots=True)
+class Subscription(Record):
+    start_ts: int
+
+    @property
+    def expires_ts(self):
+        return self.start_ts + SUB_DAYS * DAY
+
+    def to_json(self):
+        return self.start_ts
+
+    @classmethod
+    def from_json(cls, raw):
+        return cls(raw)
+
+
+@dataclass(slots=True)
+class ShopRole(Record):
+    role_id: int
+    guild_id: int
+    start_ts: int
+
+    @property
+    def expires_ts(self):
+        return self.start_ts + SUB_DAYS * DAY
+
+
+@dataclass(slots=True)
+class Timer(Record):
+    channel_id: int
+    message_id: int
+    end_ts: int
+    warned: bool = False
+
+
+@dataclass(slots=True)
+class Contest(Record):
+    contest_id: int
+    creator_id: int
+    image_url: str
+    attachment_url: str
+    secret_code: str
+    prize: int
+    duration_type: str
+    duration_value: int
+    created_ts: int
+    message_id: int = None
+    channel_id: int = None
+    # user_id -> [تعداد تلاش، زمان آخرین تلاش، 1 اگر کد درست را زده]
+    attempts: dict = dc_field(default_factory=dict)
+    winners: list = dc_field(default_factory=list)  # (user_id, ts) به ترتیب اولین پاسخ درست
+    settled: bool = False  # جایزه‌ها پرداخت شده
+    announced: bool = False  # نتیجه ارسال و پیام مسابقه بسته شده
+
+    @property
+    def end_ts(self):
+        unit = DAY if self.duration_type == "days" else 1
+        return self.created_ts + self.duration_value * unit
+
+    @classmethod
+    def from_json(cls, raw):
+        raw = {
+            # رکوردهای قبلی: نتیجه همراه تسویه ارسال می‌شد
+            "announced": raw.get("settled", False),
+            **raw,
+            "attempts": {int(k): list(v) for k, v in raw["attempts"].items()},
+            "winners": [tuple(x) for x in raw["winners"]]
+        }
+        return cls(**raw)
 
 
-# بررسی استریمر بودن
-def is_streamer(member: discord.Member):
-    return any(role.name in ("استریمر", "استریمر پلاسما")
-               for role in member.roles)
-async def save_data_async(data):
-    global data_cache
-    async with file_lock:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    # 🧩 پس از ذخیره، حافظه را با فایل هماهنگ کن
-    data_cache = load_data()
+# بخش -> سازنده‌ی رکورد؛ بخش‌های دیگر مقدار ساده (int / dict) دارند
+DATA_RECORDS = {
+    "subscription": Subscription.from_json,
+    "shoprole": ShopRole.from_json,
+    "contests": Contest.from_json,
+    "timers": Timer.from_json,
+}
 
 
+# بخش‌هایی که کلیدشان id عددی نیست
+DATA_TEXT_KEYS = {"scheduled_jobs"}  # "kind:key" -> due
 
-async def update_data():
-    global data_cache
-    await save_data_async(data_cache)
 
+def decode_docs(docs):
+    """
+    اسناد خوانده‌شده از بک‌اند (کلید رشته، JSON خام) -> شکل درون‌حافظه.
+    فرض: migrate_docs قبلاً اجرا شده، پس شکل داده‌ها قطعی است.
+    """
+    data = docs["data"]
+    for section, default in DATA_DEFAULTS.items():
+        if isinstance(default, dict) and section not in DATA_TEXT_KEYS:
+            make = DATA_RECORDS.get(section)
+            data[section] = {
+                int(k): make(v) if make else v
+                for k, v in data[section].items()
+            }
+    stream = docs["stream"]
+    stream["streamers"] = {
+        int(k): Streamer.from_json(v)
+        for k, v in stream["streamers"].items()
+    }
+    stream["guilds"] = {int(k): v for k, v in stream["guilds"].items()}
+    return docs
+
+
+# -------------------------
+# نسخه‌ی ساختار داده و مهاجرت‌ها
+# -------------------------
+# هر مهاجرت یک‌بار، موقع شروع، روی اسناد خام (قبل از decode_docs) اجرا می‌شود
+# و نسخه در data.schema_version ثبت می‌شود.
+SCHEMA_VERSION = 10
+
+
+# فیلدهای Contest در نسخه‌ی 1؛ ثابت، تا تغییر کلاس خروجی v1 را عوض نکند
+CONTEST_V1_FIELDS = ("contest_id", "creator_id", "image_url", "attachment_url",
+                     "secret_code", "prize", "duration_type", "duration_value",
+                     "created_ts", "message_id", "channel_id", "submissions",
+                     "winners")
+
+
+def _migrate_v1(docs):
+    """کلیدهای پیش‌فرض، ISO -> epoch و شکل نهایی رکوردها."""
+    data = docs.setdefault("data", {})
+    for k, v in DATA_DEFAULTS.items():
+        if not isinstance(data.get(k), type(v)):
+            data[k] = copy.deepcopy(v)
+        elif isinstance(v, dict):
+            # فقط کلیدهای عددی (id) معتبرند
+            data[k] = {key: val for key, val in data[k].items()
+                       if str(key).isdigit()}
+    data["subscription"] = {
+        uid: to_epoch(v) for uid, v in data["subscription"].items()
+    }
+    data["shoprole"] = {
+        uid: {
+            "role_id": int(v["role_id"]),
+            "guild_id": int(v["guild_id"]),
+            "start_ts": to_epoch(v.get("start_ts", v.get("start_date")))
+        }
+        for uid, v in data["shoprole"].items()
+    }
+    for cid, c in data["contests"].items():
+        c["contest_id"] = int(c.get("contest_id", cid))
+        c["creator_id"] = int(c["creator_id"])
+        c["created_ts"] = to_epoch(c.pop("created_at", c.get("created_ts")))
+        c["submissions"] = [[int(x["user_id"]), x["code"],
+                             to_epoch(x["time"])] if isinstance(x, dict) else x
+                            for x in c.get("submissions", [])]
+        c["winners"] = [[int(x["user_id"]), to_epoch(x["time"])]
+                        if isinstance(x, dict) else x
+                        for x in c.get("winners", [])]
+        data["contests"][cid] = {f: c.get(f) for f in CONTEST_V1_FIELDS}
+    stream = docs.setdefault("stream", {})
+    # بک‌اند SQLite استریمرها را از قبل در stream["streamers"] می‌گذارد
+    for group in (stream, stream.get("streamers", {})):
+        for k, v in group.items():
+            if str(k).isdigit():
+                v["start_ts"] = to_epoch(
+                    v.pop("start_date", v.get("start_ts")))
+                group[k] = {f: v[f] for f in Streamer.__slots__ if f in v}
+
+
+def _migrate_v2(docs):
+    """stream.json: استریمرها و تنظیمات هر سرور در دو فضای جدا."""
+    stream = docs["stream"]
+    streamers = stream.pop("streamers", {})
+    guilds = stream.pop("guilds", {})
+    guilds.update(stream.pop("start_stream_messages", {}))
+    for k in [k for k in stream if k.isdigit()]:
+        streamers[k] = stream.pop(k)
+    stream["streamers"] = streamers
+    stream["guilds"] = guilds
+
+
+def _migrate_v9(docs):
+    """مسابقات: فهرست همه‌ی حدس‌ها -> attempts به ازای هر کاربر."""
+    for c in docs["data"]["contests"].values():
+        won = {w[0] for w in c.get("winners") or []}
+        attempts = {}
+        for uid, _code, ts in c.pop("submissions", None) or []:
+            attempt = attempts.setdefault(uid, [0, 0, int(uid in won)])
+            attempt[0] += 1
+            attempt[1] = max(attempt[1], ts)
+        c["attempts"] = attempts
+        c["winners"] = c.get("winners") or []
+        c["settled"] = bool(c.get("settled"))
+
+
+def _migrate_v10(docs):
+    """scheduled_jobs: فهرست [due, kind, key] -> {"kind:key": due} تا هر کار جدا ذخیره شود."""
+    jobs = docs["data"].get("scheduled_jobs")
+    if isinstance(jobs, list):
+        docs["data"]["scheduled_jobs"] = {f"{kind}:{key}": due
+                                          for due, kind, key in jobs}
+
+
+# نسخه‌های 3 تا 8 فقط بخش خالی اضافه می‌کردند؛ حالا پیش‌فرض‌های DATA_DEFAULTS
+# موقع بارگذاری این کار را می‌کنند (migrate_docs).
+MIGRATIONS = [(1, _migrate_v1), (2, _migrate_v2), (9, _migrate_v9),
+              (10, _migrate_v10)]
+
+
+def migrate_docs(docs):
+    """اسناد را به SCHEMA_VERSION می‌رساند؛ True یعنی چیزی تغییر کرد."""
+    data = docs.setdefault("data", {})
+    docs.setdefault("stream", {})
+    version = data.get("schema_version", 0)
+    for target, step in MIGRATIONS:
+        if version < target:
+            step(docs)
+            print(f"🔧 مهاجرت داده‌ها به نسخه {target}")
+    # بخش‌های جدیدی که هنوز در فایل نیستند
+    for k, v in DATA_DEFAULTS.items():
+        data.setdefault(k, copy.deepcopy(v))
+    if version >= SCHEMA_VERSION:
+        return False
+    docs["data"]["schema_version"] = SCHEMA_VERSION
+    return True
+
+
+# -------------------------
+# ذخیره‌سازی تأخیری (write-behind)
+# -------------------------
+# تغییرات فقط در حافظه علامت می‌خورند و یک تسک پس‌زمینه حداکثر هر
+# FLUSH_INTERVAL_MS میلی‌ثانیه یا بعد از FLUSH_MAX_PENDING تغییر آن‌ها را ذخیره می‌کند.
+FLUSH_INTERVAL_MS = int(os.environ.get("FLUSH_INTERVAL_MS", "2000"))
+FLUSH_MAX_PENDING = int(os.environ.get("FLUSH_MAX_PENDING", "500"))
+FLUSH_TIMEOUT = float(os.environ.get("FLUSH_TIMEOUT", "10"))
+
+
+class JsonFileBackend:
+    """هر سند (data / stream) را در فایل JSON خودش نگه می‌دارد."""
+
+    def __init__(self, paths):
+        self.paths = paths  # doc -> file path
+
+    def load(self):
+        return {doc: load_json(path) for doc, path in self.paths.items()}
 
-async def update_stream():
-    async with stream_lock:
-        save_json(STREAM_FILE, stream_data)
+    async def write(self, store, dirty):
+        loop = asyncio.get_running_loop()
+        for doc in {d for d, _, _ in dirty}:
+            await loop.run_in_executor(io_executor, save_json,
+                                       self.paths[doc], store.docs[doc])
+
+
+# -------------------------
+# موتور SQLite (جایگزین data.json / stream.json)
+# -------------------------
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")  # json / sqlite / journal / sections
+SQLITE_FILE = os.environ.get("SQLITE_FILE", "bot.db")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallet (user_id INTEGER PRIMARY KEY, balance INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS subscription (user_id INTEGER PRIMARY KEY, start_ts INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS warns (user_id INTEGER PRIMARY KEY, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS badges (user_id INTEGER PRIMARY KEY, badge INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS shoprole (user_id INTEGER PRIMARY KEY, guild_id INTEGER, body TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS shoprole_guild ON shoprole (guild_id);
+CREATE TABLE IF NOT EXISTS contests (contest_id TEXT PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS server_settings (guild_id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS streamers (user_id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS stream_guilds (guild_id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS reactions (message_id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS history (user_id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS last_active (user_id INTEGER PRIMARY KEY, ts INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS timers (user_id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS scheduled_jobs (job TEXT PRIMARY KEY, due INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS kv (doc TEXT NOT NULL, section TEXT NOT NULL, body TEXT NOT NULL, PRIMARY KEY (doc, section));
+"""
+
+# (doc, section) -> (table, key column, value column, JSON value, indexed field)
+SQLITE_TABLES = {
+    ("data", "wallet"): ("wallet", "user_id", "balance", False, None),
+    ("data", "subscription"): ("subscription", "user_id", "start_ts", False, None),
+    ("data", "warns"): ("warns", "user_id", "count", False, None),
+    ("data", "badges"): ("badges", "user_id", "badge", False, None),
+    ("data", "shoprole"): ("shoprole", "user_id", "body", True, "guild_id"),
+    ("data", "contests"): ("contests", "contest_id", "body", True, None),
+    ("data", "server_settings"): ("server_settings", "guild_id", "body", True, None),
+    ("data", "reactions"): ("reactions", "message_id", "body", True, None),
+    ("data", "history"): ("history", "user_id", "body", True, None),
+    ("data", "last_active"): ("last_active", "user_id", "ts", False, None),
+    ("data", "timers"): ("timers", "user_id", "body", True, None),
+    ("data", "scheduled_jobs"): ("scheduled_jobs", "job", "due", False, None),
+    ("stream", "streamers"): ("streamers", "user_id", "body", True, None),
+    ("stream", "guilds"): ("stream_guilds", "guild_id", "body", True, None),
+}
+
+
+class SqliteBackend:
+    """
+    One row per user / guild / contest instead of one big file.
+    All writes go through a single writer thread; readers never block it (WAL).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix="sqlite-writer")
+        self._write_conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(subscription)")]
+        if "start_date" in columns:
+            # پایگاه‌داده‌ی قدیمی: start_date TEXT -> start_ts INTEGER
+            with conn:
+                conn.execute("ALTER TABLE subscription RENAME TO subscription_old")
+                conn.executescript(SQLITE_SCHEMA)
+                conn.execute("INSERT INTO subscription (user_id, start_ts) "
+                             "SELECT user_id, CAST(start_date AS INTEGER) "
+                             "FROM subscription_old")
+                conn.execute("DROP TABLE subscription_old")
+        conn.executescript(SQLITE_SCHEMA)
+        return conn
+
+    def load(self):
+        conn = self._connect()
+        docs = {"data": {}, "stream": {}}
+        try:
+            for (doc, section), (table, key_col, val_col, is_json,
+                                 _) in SQLITE_TABLES.items():
+                rows = conn.execute(f"SELECT {key_col}, {val_col} FROM {table}")
+                docs[doc][section] = {k: loads_json(v) if is_json else v
+                                      for k, v in rows}
+            for doc, section, body in conn.execute(
+                    "SELECT doc, section, body FROM kv"):
+                docs.setdefault(doc, {})[section] = loads_json(body)
+        finally:
+            conn.close()
+        return docs
+
+    @staticmethod
+    def _table_for(doc, section):
+        return (doc, section) if (doc, section) in SQLITE_TABLES else None
+
+    def _row_op(self, spec, key, value):
+        table, key_col, val_col, is_json, index_field = spec
+        if value is None:
+            return (f"DELETE FROM {table} WHERE {key_col} = ?", (key, ))
+        if isinstance(value, Record):
+            value = value.to_json()
+        body = dumps_json(value).decode("utf-8") if is_json else value
+        if index_field:
+            return (f"INSERT OR REPLACE INTO {table} ({key_col}, {val_col}, "
+                    f"{index_field}) VALUES (?, ?, ?)",
+                    (key, body, value.get(index_field)))
+        return (f"INSERT OR REPLACE INTO {table} ({key_col}, {val_col}) "
+                f"VALUES (?, ?)", (key, body))
+
+    def _section_ops(self, docs, doc, section):
+        """بازنویسی کامل یک بخش (فقط وقتی کلید مشخص نشده)."""
+        target = self._table_for(doc, section)
+        if target is None:
+            value = docs[doc].get(section)
+            if value is None:
+                return [("DELETE FROM kv WHERE doc = ? AND section = ?",
+                         (doc, section))]
+            return [("INSERT OR REPLACE INTO kv (doc, section, body) "
+                     "VALUES (?, ?, ?)",
+                     (doc, section, dumps_json(value).decode("utf-8")))]
+        spec = SQLITE_TABLES[target]
+        ops = [(f"DELETE FROM {spec[0]}", ())]
+        for key, value in docs[doc].get(section, {}).items():
+            ops.append(self._row_op(spec, key, value))
+        return ops
+
+    def _doc_ops(self, docs, doc):
+        ops = [("DELETE FROM kv WHERE doc = ?", (doc, ))]
+        for (d, _), spec in SQLITE_TABLES.items():
+            if d == doc:
+                ops.append((f"DELETE FROM {spec[0]}", ()))
+        for section in docs.get(doc, {}):
+            ops.extend(self._section_ops(docs, doc, section))
+        return ops
+
+    def ops_for(self, docs, dirty):
+        ops = []
+        for doc, section, key in dirty:
+            if section is None:
+                ops.extend(self._doc_ops(docs, doc))
+            elif key is None or self._table_for(doc, section) is None:
+                ops.extend(self._section_ops(docs, doc, section))
+            else:
+                spec = SQLITE_TABLES[self._table_for(doc, section)]
+                ops.append(
+                    self._row_op(spec, key, docs[doc].get(section, {}).get(key)))
+        return ops
+
+    def apply(self, ops):
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+        with self._write_conn:
+            for sql, params in ops:
+                self._write_conn.execute(sql, params)
+
+    async def write(self, store, dirty):
+        # مقادیر روی event loop گرفته می‌شوند، نوشتن در ترد نویسنده
+        ops = self.ops_for(store.docs, dirty)
+        await asyncio.get_running_loop().run_in_executor(
+            self._writer, self.apply, ops)
+
+
+def import_json_to_sqlite(db_path=SQLITE_FILE):
+    """انتقال یک‌باره‌ی data.json و stream.json به پایگاه داده SQLite."""
+    docs = JsonFileBackend({"data": DATA_FILE, "stream": STREAM_FILE}).load()
+    migrate_docs(docs)
+    backend = SqliteBackend(db_path)
+    ops = []
+    for doc in docs:
+        ops.extend(backend._doc_ops(docs, doc))
+    backend.apply(ops)
+    return {doc: len(v) for doc, v in docs.items()}
+
+
+# -------------------------
+# ژورنال فقط-افزودنی + اسنپ‌شات فشرده
+# -------------------------
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR", "journal")
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", "5000"))
+
+
+def apply_journal_record(docs, rec):
+    """یک رکورد ژورنال را روی داده‌ها اعمال می‌کند (برای بازپخش هنگام شروع)."""
+    if "s" not in rec:
+        docs[rec["d"]] = rec["v"]
+        return
+    doc = docs.setdefault(rec["d"], {})
+    if "k" not in rec:
+        if rec.get("x"):
+            doc.pop(rec["s"], None)
+        else:
+            doc[rec["s"]] = rec["v"]
+        return
+    section = doc.setdefault(rec["s"], {})
+    if rec.get("x"):
+        section.pop(rec["k"], None)
+    else:
+        section[rec["k"]] = rec["v"]
+
+
+def read_journal(path):
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                records.append(loads_json(line))
+            except ValueError:
+                # خط ناقص انتهای فایل (کرش وسط نوشتن)
+                break
+    return records
+
+
+class JournalBackend:
+    """
+    Each flush appends one JSON line per dirty entry to journal.<seq>.log.
+    When a segment passes JOURNAL_COMPACT_EVERY records a new segment is
+    started and the old ones are folded into snapshot.json in a background
+    thread. Startup = snapshot + replay of the newer segments.
+    """
+
+    def __init__(self, directory):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.seq = 0
+        self.records = 0
+        self._writer = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix="journal-writer")
+        self._compactor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="journal-compact")
+        self._compacting = None
+
+    def _segment(self, seq):
+        return os.path.join(self.dir, f"journal.{seq}.log")
+
+    def _segments(self):
+        seqs = []
+        for name in os.listdir(self.dir):
+            parts = name.split(".")
+            if len(parts) == 3 and parts[0] == "journal" and parts[1].isdigit():
+                seqs.append(int(parts[1]))
+        return sorted(seqs)
+
+    def _read_state(self, upto=None):
+        snap = load_json(self.snapshot_path)
+        docs = snap.get("docs", {})
+        start = last = snap.get("seq", 0)
+        for seq in self._segments():
+            if seq < start or (upto is not None and seq >= upto):
+                continue
+            for rec in read_journal(self._segment(seq)):
+                apply_journal_record(docs, rec)
+            last = seq
+        return docs, last
+
+    def load(self):
+        if not os.path.exists(self.snapshot_path) and not self._segments():
+            # اولین اجرا: شروع از فایل‌های JSON فعلی
+            docs = JsonFileBackend({
+                "data": DATA_FILE,
+                "stream": STREAM_FILE
+            }).load()
+            self._write_snapshot(0, docs)
+            return docs
+        docs, last = self._read_state()
+        # بعد از هر راه‌اندازی یک قطعه‌ی تازه
+        self.seq = last + 1
+        for doc in ("data", "stream"):
+            docs.setdefault(doc, {})
+        return docs
+
+    @staticmethod
+    def records_for(docs, dirty):
+        # کلیدها در ژورنال همیشه رشته‌اند، مثل اسنپ‌شات
+        for doc, section, key in dirty:
+            if section is None:
+                yield {"d": doc, "v": docs.get(doc, {})}
+            elif key is None:
+                if section in docs.get(doc, {}):
+                    yield {"d": doc, "s": str(section), "v": docs[doc][section]}
+                else:
+                    yield {"d": doc, "s": str(section), "x": 1}
+            else:
+                values = docs.get(doc, {}).get(section, {})
+                if key in values:
+                    yield {"d": doc, "s": section, "k": str(key), "v": values[key]}
+                else:
+                    yield {"d": doc, "s": section, "k": str(key), "x": 1}
+
+    def _write_snapshot(self, seq, docs):
+        atomic_write(self.snapshot_path, dumps_json({"seq": seq, "docs": docs}))
+
+    def compact(self, upto):
+        """قطعه‌های قبل از upto را در اسنپ‌شات ادغام و حذف می‌کند."""
+        docs, _ = self._read_state(upto)
+        self._write_snapshot(upto, docs)
+        for seq in self._segments():
+            if seq < upto:
+                os.remove(self._segment(seq))
+
+    async def write(self, store, dirty):
+        blob = b"".join(
+            dumps_json(rec) + b"\n"
+            for rec in self.records_for(store.docs, dirty))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, append_fsync,
+                                   self._segment(self.seq), blob)
+        self.records += len(dirty)
+        if self.records >= JOURNAL_COMPACT_EVERY and (
+                self._compacting is None or self._compacting.done()):
+            upto = self.seq + 1
+            self.seq, self.records = upto, 0
+            self._compacting = loop.run_in_executor(self._compactor,
+                                                    self.compact, upto)
+            self._compacting.add_done_callback(_report_compaction)
+
+
+def _report_compaction(fut):
+    if not fut.cancelled() and fut.exception():
+        print("⚠️ journal compaction failed:", fut.exception())
+
+
+# -------------------------
+# فایل جدا برای هر بخش (فقط بخش‌های تغییرکرده بازنویسی می‌شوند)
+# -------------------------
+STATE_DIR = os.environ.get("STATE_DIR", "state")
+
+
+class SectionFilesBackend:
+    """
+    One file per top-level section: state/data.wallet.json,
+    state/data.contests.json, state/stream.streamers.json, ...
+    A flush rewrites only the sections marked dirty since the last one, so a
+    wallet change never re-serializes contests and their participants.
+    """
+
+    def __init__(self, directory):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, doc, section):
+        return os.path.join(self.dir, f"{doc}.{section}.json")
+
+    def _existing(self, doc=None):
+        found = []
+        for name in os.listdir(self.dir):
+            if name.endswith(".json") and "." in name[:-5]:
+                d, section = name[:-5].split(".", 1)
+                if doc is None or d == doc:
+                    found.append((d, section))
+        return found
+
+    def _sections(self, docs, doc):
+        names = set(docs.get(doc, {}))
+        names.update(s for _, s in self._existing(doc))
+        return names
+
+    @staticmethod
+    def _value(docs, doc, section):
+        return docs.get(doc, {}).get(section)
+
+    def _save(self, docs, doc, section):
+        self._store_file(self._path(doc, section),
+                         self._value(docs, doc, section))
+
+    @staticmethod
+    def _store_file(path, value):
+        if value is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        save_json(path, value)
+
+    def load(self):
+        if not self._existing():
+            # اولین اجرا: تقسیم data.json و stream.json به فایل‌های بخش
+            docs = JsonFileBackend({
+                "data": DATA_FILE,
+                "stream": STREAM_FILE
+            }).load()
+            for doc in docs:
+                for section in self._sections(docs, doc):
+                    self._save(docs, doc, section)
+            return docs
+        docs = {"data": {}, "stream": {}}
+        for doc, section in self._existing():
+            docs.setdefault(doc, {})[section] = load_json(
+                self._path(doc, section))
+        return docs
+
+    async def write(self, store, dirty):
+        targets = set()
+        for doc, section, _ in dirty:
+            if section is None:
+                targets.update(
+                    (doc, s) for s in self._sections(store.docs, doc))
+            else:
+                targets.add((doc, section))
+        loop = asyncio.get_running_loop()
+        for doc, section in targets:
+            # انتخاب مقدار روی event loop، سریال‌سازی و نوشتن در ترد I/O
+            await loop.run_in_executor(io_executor, self._store_file,
+                                       self._path(doc, section),
+                                       self._value(store.docs, doc, section))
+
+
+def make_backend():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteBackend(SQLITE_FILE)
+    if STORAGE_BACKEND == "journal":
+        return JournalBackend(JOURNAL_DIR)
+    if STORAGE_BACKEND == "sections":
+        return SectionFilesBackend(STATE_DIR)
+    return JsonFileBackend({"data": DATA_FILE, "stream": STREAM_FILE})
+
+
+class WriteBehindStore:
+    """
+    State in memory, persistence in the background.
+    mark_dirty() is cheap and never touches the disk; `await store.flush()`
+    forces a write and is bounded by FLUSH_TIMEOUT.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.docs = backend.load()
+        self.dirty = set()  # (doc, section, key)
+        self.pending = 0
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task = None
+
+    def mark_dirty(self, doc, section=None, key=None):
+        self.dirty.add((doc, section, key))
+        self.pending += 1
+        self._wake.set()
+        if self.pending >= FLUSH_MAX_PENDING:
+            self._full.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            # صبر تا پایان بازه یا رسیدن به سقف تغییرات
+            deadline = loop.time() + FLUSH_INTERVAL_MS / 1000
+            while self.pending < FLUSH_MAX_PENDING:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush_now()
+            except Exception as e:
+                print("⚠️ write-behind flush error:", e)
+
+    def before_flush(self):
+        """پیش از هر ذخیره؛ برای داده‌هایی که فقط در حافظه جمع می‌شوند."""
+
+    async def _flush_now(self):
+        async with self._write_lock:
+            self.before_flush()
+            self._wake.clear()
+            if not self.dirty:
+                return
+            dirty, self.dirty = self.dirty, set()
+            self.pending = 0
+            try:
+                await self.backend.write(self, dirty)
+            except Exception:
+                # در دور بعد دوباره تلاش می‌شود
+                self.dirty |= dirty
+                self.pending += len(dirty)
+                self._wake.set()
+                raise
+
+    async def flush(self, timeout=FLUSH_TIMEOUT):
+        await asyncio.wait_for(self._flush_now(), timeout)
+
+
+# -------------------------
+# ایندکس رتبه‌بندی (order statistics)
+# -------------------------
+class OrderIndex:
+    """
+    Sorted multiset kept as a list of small sorted buckets plus a Fenwick
+    tree over bucket sizes: add / remove / index / positional slice are all
+    O(log n) (plus a memmove inside one bucket of at most 2 * LOAD items).
+    """
+    LOAD = 500
+
+    def __init__(self, values=(), presorted=False):
+        values = list(values) if presorted else sorted(values)
+        self.buckets = [values[i:i + self.LOAD]
+                        for i in range(0, len(values), self.LOAD)]
+        self.maxes = [b[-1] for b in self.buckets]
+        self.size = len(values)
+        self._rebuild()
+
+    def _rebuild(self):
+        self.tree = [0] * (len(self.buckets) + 1)
+        for i, b in enumerate(self.buckets):
+            self._tree_add(i, len(b))
+
+    def _tree_add(self, i, delta):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i):
+        """تعداد عناصر باکت‌های [0, i)"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, k):
+        """(شماره باکت، جایگاه در باکت) برای k-امین عنصر"""
+        pos, step = 0, 1 << (len(self.tree).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= k:
+                pos = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return pos, k
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value):
+        self.size += 1
+        if not self.buckets:
+            self.buckets, self.maxes = [[value]], [value]
+            self._rebuild()
+            return
+        i = bisect_left(self.maxes, value)
+        if i == len(self.buckets):
+            i -= 1
+            self.buckets[i].append(value)
+            self.maxes[i] = value
+        else:
+            insort(self.buckets[i], value)
+        self._tree_add(i, 1)
+        bucket = self.buckets[i]
+        if len(bucket) > 2 * self.LOAD:
+            self.buckets[i:i + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self.maxes[i:i + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._rebuild()
+
+    def remove(self, value):
+        i = bisect_left(self.maxes, value)
+        bucket = self.buckets[i]
+        del bucket[bisect_left(bucket, value)]
+        self.size -= 1
+        if bucket:
+            self.maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self.buckets[i], self.maxes[i]
+            self._rebuild()
+
+    def index(self, value):
+        i = bisect_left(self.maxes, value)
+        if i == len(self.buckets):
+            return self.size
+        return self._prefix(i) + bisect_left(self.buckets[i], value)
+
+    def slice(self, start, count):
+        out = []
+        if start >= self.size:
+            return out
+        i, j = self._locate(start)
+        while i < len(self.buckets) and len(out) < count:
+            out.extend(self.buckets[i][j:j + count - len(out)])
+            i, j = i + 1, 0
+        return out
+
+
+class Leaderboard:
+    """امتیاز هر کلید + OrderIndex از (-score, key)؛ رتبه‌ی 1 = بیشترین."""
+
+    def __init__(self, scores):
+        self.scores = dict(scores)
+        self.index = OrderIndex((-v, k) for k, v in self.scores.items())
+
+    @classmethod
+    def from_columns(cls, keys, scores):
+        """ساخت یک‌جا از دو آرایه‌ی numpy؛ مرتب‌سازی با lexsort، نه تاپل به تاپل."""
+        board = cls.__new__(cls)
+        board.scores = dict(zip(keys.tolist(), scores.tolist()))
+        order = np.lexsort((keys, -scores))
+        board.index = OrderIndex(zip((-scores[order]).tolist(),
+                                     keys[order].tolist()), presorted=True)
+        return board
+
+    def __len__(self):
+        return len(self.index)
+
+    def update(self, key, score):
+        """score=None یعنی حذف."""
+        old = self.scores.get(key)
+        if old == score:
+            return
+        if old is not None:
+            self.index.remove((-old, key))
+            del self.scores[key]
+        if score is not None:
+            self.scores[key] = score
+            self.index.add((-score, key))
+
+    def rank(self, key):
+        score = self.scores.get(key)
+        if score is None:
+            return None
+        return self.index.index((-score, key)) + 1
+
+    def page(self, start, count):
+        return [(k, -neg) for neg, k in self.index.slice(start, count)]
+
+
+# -------------------------
+# ستون‌های کیف پول (برای کارهای اقتصادی)
+# -------------------------
+class WalletArrays:
+    """
+    Column view of all wallets: row i belongs to uids[i] (also kept as the
+    uid column) and holds its balance, last activity (0 = unknown) and
+    subscription expiry (0 = none).
+    DataStore keeps the rows in step with every write, so an economy tick
+    works on ready arrays. A removed row is filled with the last one.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.uids = list(data["wallet"])
+        self.index = {uid: i for i, uid in enumerate(self.uids)}
+        n = len(self.uids)
+        size = max(1024, 2 * n)
+        self.uid = np.zeros(size, np.int64)
+        self.balance = np.zeros(size, np.int64)
+        self.active = np.zeros(size, np.int64)
+        self.expires = np.zeros(size, np.int64)
+        self.uid[:n] = self.uids
+        self.balance[:n] = np.fromiter(data["wallet"].values(), np.int64, n)
+        for i, uid in enumerate(self.uids):
+            self._fill(i, uid)
+
+    def __len__(self):
+        return len(self.uids)
+
+    def _fill(self, i, uid):
+        sub = self.data["subscription"].get(uid)
+        self.uid[i] = uid
+        self.active[i] = self.data["last_active"].get(uid, 0)
+        self.expires[i] = sub.expires_ts if sub else 0
+
+    def set_balance(self, uid, value):
+        i = self.index.get(uid)
+        if i is None:
+            i = self.index[uid] = len(self.uids)
+            self.uids.append(uid)
+            if i == len(self.balance):
+                for name in ("uid", "balance", "active", "expires"):
+                    column = getattr(self, name)
+                    setattr(self, name, np.concatenate(
+                        [column, np.zeros_like(column)]))
+            self._fill(i, uid)
+        self.balance[i] = value
+
+    def remove(self, uid):
+        i = self.index.pop(uid, None)
+        if i is None:
+            return
+        last = self.uids.pop()
+        if last != uid:
+            # ردیف آخر جای ردیف حذف‌شده می‌نشیند
+            self.uids[i] = last
+            self.index[last] = i
+            for column in (self.uid, self.balance, self.active, self.expires):
+                column[i] = column[len(self.uids)]
+
+    def set_active(self, uid, ts):
+        i = self.index.get(uid)
+        if i is not None:
+            self.active[i] = ts
+
+    def set_expires(self, uid, ts):
+        i = self.index.get(uid)
+        if i is not None:
+            self.expires[i] = ts
+
+
+# -------------------------
+# جمع‌کننده‌ی پاداش پیام‌ها
+# -------------------------
+REWARD_FLUSH_INTERVAL = float(os.environ.get("REWARD_FLUSH_INTERVAL", "5"))
+REWARD_FLUSH_MAX = int(os.environ.get("REWARD_FLUSH_MAX", "1000"))
+
+
+class RewardAccumulator:
+    """
+    Per-user counters for small, frequent rewards (1 coin per message).
+    add() is a dict increment; commit() moves all of it into wallets as one
+    batch every REWARD_FLUSH_INTERVAL seconds or after REWARD_FLUSH_MAX
+    events. DataStore.balance() includes what is still pending here.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = {}  # uid -> {source: coins}
+        self.events = 0
+        self._full = asyncio.Event()
+        self._task = None
+
+    def add(self, uid, amount=1, source="message"):
+        sources = self.pending.setdefault(uid, {})
+        sources[source] = sources.get(source, 0) + amount
+        self.events += 1
+        if self.events >= REWARD_FLUSH_MAX:
+            self._full.set()
+
+    def total(self, uid):
+        sources = self.pending.get(uid)
+        return sum(sources.values()) if sources else 0
+
+    def take(self, uid):
+        return self.pending.pop(uid, {})
+
+    def commit(self):
+        pending, self.pending, self.events = self.pending, {}, 0
+        wallet = self.store.section("wallet")
+        for uid, sources in pending.items():
+            self.store.set("wallet", uid,
+                           wallet.get(uid, 0) + sum(sources.values()))
+            for source, amount in sources.items():
+                self.store.record(uid, amount, source)
+        return len(pending)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._full.clear()
+            try:
+                await asyncio.wait_for(self._full.wait(), REWARD_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.commit()
+
+
+# -------------------------
+# تاریخچه‌ی تراکنش‌ها
+# -------------------------
+HISTORY_MAX = int(os.environ.get("HISTORY_MAX", "50"))  # برای هر کاربر
+HISTORY_MERGE_WINDOW = int(os.environ.get("HISTORY_MERGE_WINDOW", "3600"))
+HISTORY_AGGREGATED = {"message", "voice", "reaction"}
+HISTORY_SOURCES = {
+    "message": "پیام",
+    "voice": "ویس",
+    "reaction": "ری‌اکشن",
+    "stream": "استارت استریم",
+    "invite": "دعوت",
+    "contest": "مسابقه",
+    "admin": "ادمین",
+    "shop": "فروشگاه",
+    "order": "سفارش",
+    "renew": "تمدید",
+    "refund": "بازگشت پول",
+    "transfer": "انتقال",
+    "bulk": "پرداخت گروهی",
+    "decay": "کاهش عدم فعالیت",
+    "interest": "سود اشتراک",
+    "inflation": "سقف تورم",
+    "leave": "خروج از سرور",
+    "other": "سایر",
+}
+
+
+# -------------------------
+# آمار جریان سکه (ساخته / سوزانده‌شده)
+# -------------------------
+# نام بازه -> (طول هر سطل به ثانیه، تعداد سطل‌های نگه‌داشته‌شده)
+TELEMETRY_WINDOWS = {
+    "minute": (60, 60),
+    "hour": (3600, 24),
+    "day": (DAY, 30),
+}
+
+
+class EconomyTelemetry:
+    """
+    Rolling minted/burned totals per source. Each window keeps a few fixed
+    width buckets ({bucket: {source: [minted, burned]}}) plus an all-time
+    total, so reports sum at most 60 small dicts instead of scanning history.
+    Persisted as flat rows in data["telemetry"] on the next write-behind
+    flush after a change.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.buckets = {name: {} for name in TELEMETRY_WINDOWS}
+        self.total = {}
+        self.changed = False
+        for name, idx, source, minted, burned in store.data["telemetry"]:
+            target = (self.total if name == "all" else
+                      self.buckets[name].setdefault(idx, {}))
+            target[source] = [minted, burned]
+
+    @staticmethod
+    def _add(target, source, amount):
+        pair = target.setdefault(source, [0, 0])
+        if amount > 0:
+            pair[0] += amount
+        else:
+            pair[1] -= amount
+
+    def observe(self, amount, source, now):
+        for name, (width, keep) in TELEMETRY_WINDOWS.items():
+            idx = now // width
+            buckets = self.buckets[name]
+            if idx not in buckets:
+                buckets[idx] = {}
+                for old in [b for b in buckets if b <= idx - keep]:
+                    del buckets[old]
+            self._add(buckets[idx], source, amount)
+        self._add(self.total, source, amount)
+        self.changed = True
+
+    def window(self, name, now=None):
+        """جمع بازه: {source: [minted, burned]}؛ name = all یا یکی از TELEMETRY_WINDOWS."""
+        if name == "all":
+            return {src: list(pair) for src, pair in self.total.items()}
+        width, keep = TELEMETRY_WINDOWS[name]
+        first = (now or now_ts()) // width - keep + 1
+        flows = {}
+        for idx, bucket in self.buckets[name].items():
+            if idx >= first:
+                for src, (minted, burned) in bucket.items():
+                    pair = flows.setdefault(src, [0, 0])
+                    pair[0] += minted
+                    pair[1] += burned
+        return flows
+
+    def persist(self):
+        rows = [["all", 0, src, m, b] for src, (m, b) in self.total.items()]
+        for name, buckets in self.buckets.items():
+            for idx, bucket in buckets.items():
+                rows.extend([name, idx, src, m, b]
+                            for src, (m, b) in bucket.items())
+        self.store.data["telemetry"] = rows
+        self.store.mark_dirty("data", "telemetry")
+        self.changed = False
+
+
+# -------------------------
+# DataStore: تنها منبع داده‌ها
+# -------------------------
+class DataStore(WriteBehindStore):
+    """
+    The one owner of data.json / stream.json state.
+    Reads are plain in-memory lookups; every write goes through set/pop/touch
+    so the exact (section, key) that changed is what gets persisted.
+    Keys are int ids and values are compact records (see decode_docs).
+    """
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        if migrate_docs(self.docs):
+            # نتیجه‌ی مهاجرت یک‌بار کامل ذخیره می‌شود
+            self.mark_dirty("data")
+            self.mark_dirty("stream")
+        decode_docs(self.docs)
+        self.data = self.docs["data"]
+        self.stream = self.docs["stream"]
+        self.rewards = RewardAccumulator(self)
+        self.voice = None  # VoiceTracker؛ بعد از ساخته شدنش وصل می‌شود
+        self.telemetry = EconomyTelemetry(self)
+        # جمع کل کیف پول‌ها؛ مثل رتبه‌بندی با هر set/pop به‌روز می‌شود
+        self.supply = sum(self.data["wallet"].values())
+        self.arrays = WalletArrays(self.data)
+        # با هر set/pop کیف پول و هر تغییر استریمر به‌روز می‌شوند
+        self.boards = {
+            "wallet": Leaderboard(self.data["wallet"]),
+            "streams": Leaderboard({uid: s.streams_count
+                                    for uid, s in self.streamers()}),
+            "invites": Leaderboard({uid: s.invite_count
+                                    for uid, s in self.streamers()}),
+        }
+
+    # ---- data.json ----
+    def section(self, name):
+        return self.data[name]
+
+    def get(self, section, key, default=None):
+        return self.data[section].get(key, default)
+
+    def set(self, section, key, value):
+        if section == "wallet":
+            self.supply += value - self.data["wallet"].get(key, 0)
+            self.boards["wallet"].update(key, value)
+            self.arrays.set_balance(key, value)
+        elif section == "last_active":
+            self.arrays.set_active(key, value)
+        elif section == "subscription":
+            self.arrays.set_expires(key, value.expires_ts)
+        self.data[section][key] = value
+        self.mark_dirty("data", section, key)
+        return value
+
+    def pop(self, section, key):
+        value = self.data[section].pop(key, None)
+        if section == "wallet":
+            self.supply -= value or 0
+            self.boards["wallet"].update(key, None)
+            self.arrays.remove(key)
+        elif section == "last_active":
+            self.arrays.set_active(key, 0)
+        elif section == "subscription":
+            self.arrays.set_expires(key, 0)
+        if value is not None:
+            self.mark_dirty("data", section, key)
+        return value
+
+    def set_balances(self, rows, values):
+        """
+        نوشتن دسته‌ای موجودی ردیف‌های WalletArrays (کارهای اقتصادی): یک
+        update روی dict، رتبه‌بندی و علامت ذخیره یک‌جا وقتی ردیف‌ها زیادند.
+        """
+        wallet = self.data["wallet"]
+        arrays = self.arrays
+        n = len(arrays)
+        self.supply += int(values.sum() - arrays.balance[rows].sum())
+        arrays.balance[rows] = values
+        if len(rows) * 8 > n:
+            # بیشتر کیف پول‌ها عوض شده‌اند: همه یک‌جا
+            wallet.update(zip(arrays.uids, arrays.balance[:n].tolist()))
+            self.boards["wallet"] = Leaderboard.from_columns(
+                arrays.uid[:n], arrays.balance[:n])
+            self.mark_dirty("data", "wallet")
+        else:
+            board = self.boards["wallet"]
+            for uid, value in zip(arrays.uid[rows].tolist(), values.tolist()):
+                wallet[uid] = value
+                board.update(uid, value)
+                self.mark_dirty("data", "wallet", uid)
+
+    def before_flush(self):
+        if self.telemetry.changed:
+            self.telemetry.persist()
+
+    def touch(self, section, key=None):
+        """بعد از تغییر درجای یک مقدار تو در تو (مثلاً contest) صدا زده شود."""
+        self.mark_dirty("data", section, key)
+
+    def balance(self, uid):
+        # شامل پاداش‌ها و زمان ویس که هنوز در کیف پول ثبت نشده‌اند
+        voice = self.voice.pending(uid) if self.voice else 0
+        return self.get("wallet", uid, 0) + self.rewards.total(uid) + voice
+
+    def add_balance(self, uid, amount, source="other"):
+        # پاداش‌های در صف (و ویس باز) همین کاربر هم‌زمان اعمال می‌شوند
+        if self.voice:
+            self.voice.settle(uid)
+        current = self.get("wallet", uid, 0)
+        for src, coins in self.rewards.take(uid).items():
+            current += coins
+            self.record(uid, coins, src)
+        new = self.set("wallet", uid, max(0, current + amount))
+        self.record(uid, new - current, source)
+        return new
+
+    def record(self, uid, amount, source):
+        """
+        ثبت در تاریخچه‌ی کاربر: [ts, amount, source]، حداکثر HISTORY_MAX مورد.
+        پاداش‌های پرتکرار (پیام، ویس، ری‌اکشن) در یک بازه در یک مورد جمع می‌شوند.
+        """
+        if not amount:
+            return
+        now = now_ts()
+        self.telemetry.observe(amount, source, now)
+        if source in HISTORY_AGGREGATED:
+            self.set("last_active", uid, now)
+        entries = self.data["history"].setdefault(uid, [])
+        last = entries[-1] if entries else None
+        if (last and source in HISTORY_AGGREGATED and last[2] == source
+                and now - last[0] < HISTORY_MERGE_WINDOW):
+            last[0] = now
+            last[1] += amount
+        else:
+            entries.append([now, amount, source])
+            if len(entries) > HISTORY_MAX:
+                del entries[0]
+        self.mark_dirty("data", "history", uid)
+
+    def guild_settings(self, gid):
+        return self.get("server_settings", gid, {})
+
+    # ---- stream.json ----
+    def streamer(self, uid):
+        return self.stream["streamers"].get(uid)
+
+    def streamers(self):
+        return list(self.stream["streamers"].items())
+
+    def _index_streamer(self, uid):
+        record = self.stream["streamers"].get(uid)
+        self.boards["streams"].update(uid, record and record.streams_count)
+        self.boards["invites"].update(uid, record and record.invite_count)
+
+    def set_streamer(self, uid, record):
+        self.stream["streamers"][uid] = record
+        self.mark_dirty("stream", "streamers", uid)
+        self._index_streamer(uid)
+
+    def pop_streamer(self, uid):
+        if self.stream["streamers"].pop(uid, None) is not None:
+            self.mark_dirty("stream", "streamers", uid)
+            self._index_streamer(uid)
+
+    def touch_streamer(self, uid):
+        self.mark_dirty("stream", "streamers", uid)
+        self._index_streamer(uid)
+
+    def stream_guild(self, gid):
+        return self.stream["guilds"].get(gid)
+
+    def set_stream_guild(self, gid, info):
+        self.stream["guilds"][gid] = info
+        self.mark_dirty("stream", "guilds", gid)
+
+
+try:
+    store = DataStore(make_backend())
+except CorruptDataError as e:
+    if sys.argv[1:2] != ["restore"]:
+        sys.exit(f"❌ {e}")
+    # فقط برای فرمان restore؛ این store هیچ‌وقت ذخیره نمی‌شود
+    store = DataStore(JsonFileBackend({}))
+
+
+# -------------------------
+# تراکنش‌های کیف پول (قفل جدا برای هر کاربر)
+# -------------------------
+class WalletLedger:
+    """
+    Balance-checked coin movements. Every call holds the locks of the users
+    it touches (acquired in id order, so two transfers can't deadlock);
+    interactions of different users never wait on each other. Code that
+    changes several things together uses hold() and store.add_balance().
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._locks = weakref.WeakValueDictionary()  # uid -> asyncio.Lock
+
+    def _lock(self, uid):
+        lock = self._locks.get(uid)
+        if lock is None:
+            lock = self._locks[uid] = asyncio.Lock()
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *uids):
+        locks = [self._lock(uid) for uid in sorted(set(uids))]
+        async with contextlib.AsyncExitStack() as stack:
+            for lock in locks:
+                await stack.enter_async_context(lock)
+            yield
+
+    async def credit(self, uid, amount, source="other"):
+        """افزودن سکه (مقدار منفی = اصلاح ادمین، حداقل صفر). موجودی جدید را برمی‌گرداند."""
+        async with self.hold(uid):
+            return self.store.add_balance(uid, amount, source)
+
+    async def debit_if_sufficient(self, uid, amount, source="other"):
+        """کم کردن فقط اگر موجودی کافی باشد؛ False یعنی هیچ تغییری نکرد."""
+        async with self.hold(uid):
+            if self.store.balance(uid) < amount:
+                return False
+            self.store.add_balance(uid, -amount, source)
+            return True
+
+    async def transfer(self, src, dst, amount, source="transfer"):
+        """انتقال بین دو کاربر؛ قفل هر دو به ترتیب id. False یعنی هیچ تغییری نکرد."""
+        async with self.hold(src, dst):
+            if src == dst or amount <= 0 or self.store.balance(src) < amount:
+                return False
+            self.store.add_balance(src, -amount, source)
+            self.store.add_balance(dst, amount, source)
+            return True
+
+    async def credit_many(self, uids, amount, source="other"):
+        """
+        یک تراکنش گروهی: قفل همه‌ی کاربران گرفته می‌شود و تغییرات بدون await
+        اعمال می‌شوند؛ ذخیره با write-behind یا store.flush() فراخواننده. {uid: موجودی جدید}
+        """
+        async with self.hold(*uids):
+            return {uid: self.store.add_balance(uid, amount, source)
+                    for uid in uids}
+
+
+ledger = WalletLedger(store)
+
+
+# -------------------------
+# جلوگیری از اجرای دوباره با کلیک تکراری
+# -------------------------
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "15"))
+
+
+class IdempotencyCache:
+    """
+    Short-lived results of side-effecting actions keyed by
+    (user, message, action). A repeat while the first run is in flight waits
+    for it; a repeat within IDEMPOTENCY_TTL seconds after it finished reuses
+    its result. Finished entries are kept in completion (= expiry) order,
+    so pruning is O(expired).
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL):
+        self.ttl = ttl
+        self._running = {}  # key -> future
+        self._entries = OrderedDict()  # key -> (expires, future)
+
+    def _prune(self, now):
+        while self._entries:
+            key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    async def run(self, key, action):
+        """(نتیجه، تکراری بود؟)؛ action یک تابع async بدون آرگومان است."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._prune(now)
+        future = self._running.get(key)
+        if future is None:
+            entry = self._entries.get(key)
+            future = entry[1] if entry is not None else None
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = self._running[key] = loop.create_future()
+        try:
+            result = await action()
+        except BaseException as e:
+            # شکست ثبت نمی‌شود تا کاربر بتواند دوباره تلاش کند
+            future.set_exception(e)
+            future.exception()  # هشدار «exception never retrieved» نده
+            raise
+        finally:
+            del self._running[key]
+        future.set_result(result)
+        # مهلت از پایان اجرا حساب می‌شود
+        self._entries[key] = (loop.time() + self.ttl, future)
+        return result, False
+
+
+idempotency = IdempotencyCache()
+
+
+async def respond_once(interaction: discord.Interaction, action_name, action):
+    """
+    اجرای action یک‌بار برای هر (کاربر، پیام، اقدام)؛ کلیک‌های تکراری همان
+    پاسخ اول را می‌گیرند. action متن پاسخ (ephemeral) را برمی‌گرداند.
+    """
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    message_id = interaction.message.id if interaction.message else None
+    try:
+        text, _ = await idempotency.run(
+            (interaction.user.id, message_id, action_name), action)
+    except Exception as e:
+        print(f"⚠️ {action_name} failed:", e)
+        text = "❌ خطایی رخ داد، لطفاً دوباره تلاش کنید."
+    await interaction.followup.send(text, ephemeral=True)
+
+
+# -------------------------
+# به‌روزرسانی پیام‌های زنده (تایمرها و شمارنده‌ی مسابقات)
+# -------------------------
+# (باقی‌مانده تا مهلت، فاصله‌ی بررسی) به ثانیه؛ نزدیک مهلت سریع‌تر
+LIVE_CADENCE = ((5 * 60, 5), (3600, 15), (DAY, 60))
+LIVE_IDLE_CADENCE = 300
+# بودجه‌ی ویرایش هر کانال (token bucket)
+LIVE_CHANNEL_BURST = 5
+LIVE_CHANNEL_RATE = 0.5  # ویرایش در ثانیه
+
+
+@dataclass(slots=True, eq=False)
+class LiveMessage:
+    message: object
+    state: object  # () -> مقدار قابل مقایسه، ارزان
+    render: object  # (state) -> kwargs برای message.edit
+    deadline: int  # epoch
+    on_done: object = None
+    last: object = None
+    due: float = 0.0
+    task: object = None
+
+
+class LiveMessageRefresher:
+    """
+    One task for every self-updating message. Each tracked message is
+    re-checked on a cadence that tightens as its deadline approaches; it is
+    only edited when state() differs from what was last sent, and edits
+    draw from a per-channel token bucket (postponed, never dropped).
+    """
+
+    def __init__(self):
+        self.entries = {}  # key -> LiveMessage
+        self._heap = []  # (due, seq, key)
+        self._seq = 0
+        self._budget = {}  # channel_id -> (tokens, updated)
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def track(self, key, message, state, render, deadline, on_done=None,
+              sent=None):
+        """sent: وضعیتی که پیام همین حالا نشان می‌دهد (اگر معلوم است)."""
+        loop = asyncio.get_running_loop()
+        entry = LiveMessage(message, state, render, deadline, on_done, sent)
+        self.entries[key] = entry
+        self._push(key, entry, loop.time())
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def untrack(self, key):
+        """توقف به‌روزرسانی؛ منتظر ویرایش در حال ارسال می‌ماند."""
+        entry = self.entries.pop(key, None)
+        if entry and entry.task:
+            await asyncio.gather(entry.task, return_exceptions=True)
+
+    def _push(self, key, entry, due):
+        entry.due = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, key))
+        if self._heap[0][2] == key:
+            self._wake.set()
+
+    @staticmethod
+    def _cadence(remaining):
+        for limit, every in LIVE_CADENCE:
+            if remaining <= limit:
+                return every
+        return LIVE_IDLE_CADENCE
+
+    def _take_token(self, channel_id, now):
+        """0 یعنی مجاز؛ وگرنه چند ثانیه تا توکن بعدی."""
+        tokens, updated = self._budget.get(channel_id, (LIVE_CHANNEL_BURST, now))
+        tokens = min(LIVE_CHANNEL_BURST,
+                     tokens + (now - updated) * LIVE_CHANNEL_RATE)
+        if tokens >= 1:
+            self._budget[channel_id] = (tokens - 1, now)
+            return 0
+        self._budget[channel_id] = (tokens, now)
+        return (1 - tokens) / LIVE_CHANNEL_RATE
+
+    async def _edit(self, key, entry, kwargs):
+        try:
+            await entry.message.edit(**kwargs)
+        except discord.NotFound:
+            # پیام حذف شده؛ مثل رسیدن به مهلت، صاحبش هم خبردار می‌شود
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+                if entry.on_done:
+                    entry.on_done()
+        except Exception as e:
+            print(f"⚠️ live edit {key} failed:", e)
+
+    def _tick(self, key, entry, now):
+        remaining = entry.deadline - time.time()
+        state = entry.state()
+        if state != entry.last:
+            if entry.task and not entry.task.done():
+                self._push(key, entry, now + 1)
+                return
+            wait = self._take_token(entry.message.channel.id, now)
+            if wait:
+                self._push(key, entry, now + wait)
+                return
+            entry.last = state
+            entry.task = asyncio.get_running_loop().create_task(
+                self._edit(key, entry, entry.render(state)))
+        if remaining <= 0:
+            del self.entries[key]
+            if entry.on_done:
+                entry.on_done()
+            return
+        # یک بررسی دقیقاً سر مهلت برای نمایش وضعیت نهایی
+        self._push(key, entry, now + min(self._cadence(remaining), remaining))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wake.clear()
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, key = heapq.heappop(self._heap)
+                entry = self.entries.get(key)
+                if entry is not None and entry.due == due:
+                    self._tick(key, entry, now)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+refresher = LiveMessageRefresher()
+
+
+# -------------------------
+# سیاست‌های دوره‌ای اقتصاد (کاهش، سود، سقف تورم)
+# -------------------------
+ECON_INTERVAL = int(os.environ.get("ECON_INTERVAL", str(DAY)))
+ECON_DECAY_DAYS = int(os.environ.get("ECON_DECAY_DAYS", "30"))
+ECON_DECAY_RATE = float(os.environ.get("ECON_DECAY_RATE", "0"))  # مثلاً 0.02
+ECON_INTEREST_RATE = float(os.environ.get("ECON_INTEREST_RATE", "0"))
+ECON_SUPPLY_CAP = int(os.environ.get("ECON_SUPPLY_CAP", "0"))  # 0 = بدون سقف
+ECON_HISTORY_CHUNK = int(os.environ.get("ECON_HISTORY_CHUNK", "5000"))
+
+
+class EconomyJobs:
+    """
+    Periodic wallet-wide policies applied in one pass: inactivity decay,
+    interest for active subscribers and a cap on the total coin supply.
+    The maths runs vectorised over store.arrays (row i = uids[i]); the new
+    balances are written back in one batch without awaits, telemetry gets
+    one observation per source, and per-user history follows in chunks.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._task = None
+
+    @staticmethod
+    def enabled():
+        return bool(ECON_DECAY_RATE or ECON_INTEREST_RATE or ECON_SUPPLY_CAP)
+
+    def _deltas(self, now):
+        """(موجودی‌های جدید، {source: آرایه‌ی تغییر هر ردیف})"""
+        arrays = self.store.arrays
+        n = len(arrays)
+        bal = arrays.balance[:n].copy()
+        deltas = {}
+        if ECON_DECAY_RATE:
+            d = -np.floor(bal * ECON_DECAY_RATE).astype(np.int64)
+            d[arrays.active[:n] >= now - ECON_DECAY_DAYS * DAY] = 0
+            bal += d
+            deltas["decay"] = d
+        if ECON_INTEREST_RATE:
+            d = np.floor(bal * ECON_INTEREST_RATE).astype(np.int64)
+            d[arrays.expires[:n] <= now] = 0
+            bal += d
+            deltas["interest"] = d
+        total = int(bal.sum())
+        if ECON_SUPPLY_CAP and total > ECON_SUPPLY_CAP:
+            d = np.floor(bal * (ECON_SUPPLY_CAP / total)).astype(np.int64) - bal
+            bal += d
+            deltas["inflation"] = d
+        return bal, deltas
+
+    def run_once(self):
+        """
+        یک دور کامل؛ بدون await، پس هیچ تراکنش دیگری وسط آن اجرا نمی‌شود.
+        (تعداد کیف پول‌های تغییرکرده، {source: (uids, amounts)} برای تاریخچه)
+        """
+        now = now_ts()
+        arrays = self.store.arrays
+        n = len(arrays)
+        # کیف پول بدون سابقه (پرداخت ادمین، فروش...): مهلت از همین حالا
+        unknown = np.flatnonzero(arrays.active[:n] == 0)
+        if unknown.size:
+            arrays.active[unknown] = now
+            uids = arrays.uid[unknown].tolist()
+            self.store.data["last_active"].update(dict.fromkeys(uids, now))
+            if unknown.size * 8 > n:
+                self.store.mark_dirty("data", "last_active")
+            else:
+                for uid in uids:
+                    self.store.mark_dirty("data", "last_active", uid)
+        balances, deltas = self._deltas(now)
+        rows = np.flatnonzero(balances != arrays.balance[:n])
+        changes = {}
+        for source, d in deltas.items():
+            idx = np.flatnonzero(d)
+            if idx.size:
+                self.store.telemetry.observe(int(d[idx].sum()), source, now)
+                changes[source] = (arrays.uid[idx], d[idx])
+        self.store.set_balances(rows, balances[rows])
+        self.store.data["economy_last_run"] = now
+        self.store.mark_dirty("data", "economy_last_run")
+        return int(rows.size), changes
+
+    async def record_history(self, changes, now=None):
+        """تاریخچه‌ی هر کاربر، ECON_HISTORY_CHUNK مورد در هر نوبت از event loop."""
+        now = now or now_ts()
+        history = self.store.data["history"]
+        wallet = self.store.data["wallet"]
+        for source, (uids, amounts) in changes.items():
+            for start in range(0, len(uids), ECON_HISTORY_CHUNK):
+                end = start + ECON_HISTORY_CHUNK
+                for uid, amount in zip(uids[start:end].tolist(),
+                                       amounts[start:end].tolist()):
+                    if uid not in wallet:
+                        continue  # در این فاصله از سرور رفته
+                    entries = history.setdefault(uid, [])
+                    entries.append([now, amount, source])
+                    if len(entries) > HISTORY_MAX:
+                        del entries[0]
+                    self.store.mark_dirty("data", "history", uid)
+                await asyncio.sleep(0)
+
+    def start(self):
+        if self.enabled() and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            last = self.store.data.get("economy_last_run", 0)
+            await asyncio.sleep(max(0, last + ECON_INTERVAL - now_ts()))
+            try:
+                changed, changes = self.run_once()
+                await self.record_history(changes)
+                await self.store.flush()
+                print(f"💹 economy jobs: {changed} wallets updated")
+            except Exception as e:
+                print("⚠️ economy jobs failed:", e)
+                await asyncio.sleep(60)
+
+
+economy = EconomyJobs(store)
+
+
+# -------------------------
+# بایگانی داده‌های سرد
+# -------------------------
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+
+
+class ArchiveStore:
+    """
+    Cold storage for ended contests, expired subscriptions / shop roles and
+    departed members: one append-only JSONL file per kind. Nothing is kept
+    in memory; a file is only read when an admin runs /archive.
+    """
+    KINDS = ("contests", "subscriptions", "members")
+
+    def __init__(self, directory):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind):
+        return os.path.join(self.dir, f"{kind}.jsonl")
+
+    async def put(self, kind, key, value):
+        line = dumps_json({"id": key, "at": now_ts(), "v": value}) + b"\n"
+        await asyncio.get_running_loop().run_in_executor(
+            io_executor, append_fsync, self._path(kind), line)
+
+    def _scan(self, kind, key):
+        path = self._path(kind)
+        if not os.path.exists(path):
+            return []
+        # پیش‌فیلتر بایتی تا فقط خطوط مرتبط parse شوند
+        needle = b'"id":%d,' % key
+        found = []
+        with open(path, "rb") as f:
+            for line in f:
+                if needle in line:
+                    try:
+                        found.append(loads_json(line))
+                    except ValueError:
+                        continue
+        return found
+
+    async def find(self, kind, key):
+        return await asyncio.get_running_loop().run_in_executor(
+            io_executor, self._scan, kind, key)
+
+
+archive = ArchiveStore(ARCHIVE_DIR)
+
+
+async def archive_contest(contest_id: int):
+    """مسابقه‌ی پایان‌یافته را از داده‌ی اصلی به بایگانی منتقل می‌کند."""
+    contest = store.get("contests", contest_id)
+    if contest:
+        await archive.put("contests", contest_id, contest)
+        store.pop("contests", contest_id)
+
+
+# -------------------------
+# بکاپ فشرده و افزایشی با چرخش ساعتی / روزانه / هفتگی
+# -------------------------
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.environ.get("BACKUP_INTERVAL", "3600"))  # 0 = خاموش
+BACKUP_FULL_EVERY = int(os.environ.get("BACKUP_FULL_EVERY", "24"))
+BACKUP_KEEP = {
+    3600: int(os.environ.get("BACKUP_KEEP_HOURLY", "24")),
+    DAY: int(os.environ.get("BACKUP_KEEP_DAILY", "7")),
+    7 * DAY: int(os.environ.get("BACKUP_KEEP_WEEKLY", "4")),
+}
+BACKUP_STAMP = "%Y%m%d-%H%M%S"
+
+
+def backup_stamp_to_ts(stamp):
+    return int(datetime.strptime(stamp, BACKUP_STAMP).replace(
+        tzinfo=timezone.utc).timestamp())
+
+
+class BackupManager:
+    """
+    Periodic gzip snapshots of the whole store in backups/.
+    Every BACKUP_FULL_EVERY-th snapshot is full; the ones in between only
+    carry the sections that changed since that full one (differential), so a
+    restore reads at most two files. Runs on its own thread, never on the
+    event loop.
+
+    file names: <stamp>.full.json.gz / <stamp>.diff-<base stamp>.json.gz
+    """
+
+    def __init__(self, directory):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+        self.base = None  # stamp آخرین بکاپ کامل
+        self.base_hashes = {}  # (doc, section) -> digest
+        self.since_full = 0
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix="backup")
+        self._task = None
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def snapshots(self):
+        """[(ts, stamp, base stamp یا None, file name)] قدیمی به جدید"""
+        found = []
+        for name in os.listdir(self.dir):
+            if not name.endswith(".json.gz"):
+                continue
+            stamp, kind = name[:-len(".json.gz")].split(".", 1)
+            base = kind[len("diff-"):] if kind.startswith("diff-") else None
+            found.append((backup_stamp_to_ts(stamp), stamp, base, name))
+        return sorted(found, key=lambda snap: snap[:2])
+
+    @staticmethod
+    def capture(docs):
+        """کپی سطحی هر بخش؛ روی event loop، تا ترد backup داده‌ی در حال تغییر نخواند."""
+        return {doc: {section: value.copy() if isinstance(value, (dict, list))
+                      else value
+                      for section, value in sections.items()}
+                for doc, sections in docs.items()}
+
+    def take(self, docs):
+        """یک بکاپ از خروجی capture می‌گیرد (در ترد backup) و نام فایل را برمی‌گرداند."""
+        stamp = datetime.now(timezone.utc).strftime(BACKUP_STAMP)
+        blobs = {(doc, section): dumps_json(value)
+                 for doc, sections in docs.items()
+                 for section, value in sections.items()}
+        hashes = {k: hashlib.blake2b(b, digest_size=16).digest()
+                  for k, b in blobs.items()}
+        full = self.base is None or self.since_full >= BACKUP_FULL_EVERY
+        if full:
+            changed, removed = list(blobs), []
+            name = f"{stamp}.full.json.gz"
+        else:
+            changed = [k for k in blobs if hashes[k] != self.base_hashes.get(k)]
+            removed = [list(k) for k in self.base_hashes if k not in blobs]
+            name = f"{stamp}.diff-{self.base}.json.gz"
+        # بخش‌ها همان بایت‌های سریال‌شده‌اند؛ دوباره parse نمی‌شوند
+        body = b",".join(b"[" + dumps_json(doc) + b"," + dumps_json(section) +
+                         b"," + blobs[(doc, section)] + b"]"
+                         for doc, section in changed)
+        payload = (b'{"sections":[' + body + b'],"removed":' +
+                   dumps_json(removed) + b"}")
+        atomic_write(self._path(name), gzip.compress(payload, 6))
+        if full:
+            self.base, self.base_hashes, self.since_full = stamp, hashes, 0
+        self.since_full += 1
+        self.rotate()
+        return name
+
+    def rotate(self):
+        snaps = self.snapshots()
+        if not snaps:
+            return
+        keep = {snaps[-1][1]}
+        for period, count in BACKUP_KEEP.items():
+            buckets = set()
+            for ts, stamp, _, _ in reversed(snaps):
+                if ts // period in buckets:
+                    continue
+                if len(buckets) >= count:
+                    break
+                buckets.add(ts // period)
+                keep.add(stamp)
+        # پایه‌ی هر diff نگه‌داشته‌شده هم باید بماند
+        keep |= {base for _, stamp, base, _ in snaps if stamp in keep and base}
+        if self.base:
+            keep.add(self.base)
+        for _, stamp, _, name in snaps:
+            if stamp not in keep:
+                os.remove(self._path(name))
+
+    def read(self, name):
+        with open(self._path(name), "rb") as f:
+            return loads_json(gzip.decompress(f.read()))
+
+    def restore_docs(self, name):
+        """اسناد خام (قابل ذخیره در data.json / stream.json) از یک بکاپ."""
+        snap = self.read(name)
+        docs = {}
+        kind = name[:-len(".json.gz")].split(".", 1)[1]
+        if kind.startswith("diff-"):
+            docs = self.restore_docs(f"{kind[len('diff-'):]}.full.json.gz")
+        for doc, section, value in snap["sections"]:
+            docs.setdefault(doc, {})[section] = value
+        for doc, section in snap["removed"]:
+            docs.get(doc, {}).pop(section, None)
+        return docs
+
+    def start(self):
+        if BACKUP_INTERVAL > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                name = await loop.run_in_executor(self._executor, self.take,
+                                                  self.capture(store.docs))
+                print("💾 backup:", name)
+            except Exception as e:
+                print("⚠️ backup failed:", e)
+            await asyncio.sleep(BACKUP_INTERVAL)
+
+
+backups = BackupManager(BACKUP_DIR)
+
+
+def restore_backup(name):
+    """بازسازی data.json و stream.json از یک بکاپ (نسخه‌ی فعلی کنار گذاشته می‌شود)."""
+    docs = backups.restore_docs(name)
+    for doc, path in (("data", DATA_FILE), ("stream", STREAM_FILE)):
+        if os.path.exists(path):
+            os.replace(path, f"{path}.pre-restore")
+        save_json(path, docs.get(doc, {}))
+    return {doc: len(v) for doc, v in docs.items()}
+
+
+# بررسی استریمر بودن
+def is_streamer(member: discord.Member):
+    return any(role.name in ("استریمر", "استریمر پلاسما")
+               for role in member.roles)
 
 
 # پاک کردن اطلاعات استریمر هنگام خروج
 @bot.event
 async def on_member_remove(member: discord.Member):
-    uid = str(member.id)
-    data.get("wallet", {}).pop(uid, None)
-    stream_data.pop(uid, None)
-    await update_data()
-    await update_stream()
+    uid = member.id
+    store.pop("wallet", uid)
+    store.pop_streamer(uid)
 
 
 # -------------------------
@@ -200,31 +2161,30 @@ async def pstream(interaction: Interaction, member: discord.Member = None):
         await interaction.response.send_message("❌ شما استریمر نیستید.",
                                                 ephemeral=True)
         return
-    uid = str(user.id)
-    streamer = stream_data.get(uid)
+    uid = user.id
+    streamer = store.streamer(uid)
     if not streamer:
         await interaction.response.send_message("❌ اطلاعات استریمر یافت نشد.",
                                                 ephemeral=True)
         return
 
-    start_date = datetime.fromisoformat(streamer.get("start_date"))
-    days_since = (datetime.now(timezone.utc) - start_date).days
+    days_since = (now_ts() - streamer.start_ts) // DAY
 
     embed = discord.Embed(title=f"📋 پروفایل استریمر {user.name}",
                           color=discord.Color.purple())
     embed.set_thumbnail(url=user.display_avatar.url)
-    embed.set_image(url=streamer.get("banner_url"))
+    embed.set_image(url=streamer.banner_url)
     embed.add_field(name="تعداد استریم‌ها",
-                    value=str(streamer.get("streams_count", 0)))
+                    value=str(streamer.streams_count))
     embed.add_field(name="تعداد تخلف‌ها",
-                    value=str(streamer.get("violations", 0)))
-    embed.add_field(name="لینک دعوت", value=streamer.get("invite_link"))
+                    value=str(streamer.violations))
+    embed.add_field(name="لینک دعوت", value=streamer.invite_link)
     embed.add_field(name="میزان پول",
-                    value=f"{data.get('wallet', {}).get(uid, 0)} سکه")
+                    value=f"{store.balance(uid)} سکه")
     embed.add_field(name="روز از استریمر شدن", value=f"{days_since} روز")
-    embed.add_field(name="لینک استریم", value=streamer.get("stream_link"))
+    embed.add_field(name="لینک استریم", value=streamer.stream_link)
     embed.add_field(name="تعداد دعوتی شما",
-                    value=str(streamer.get("invite_count", 0)))
+                    value=str(streamer.invite_count))
 
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -234,18 +2194,18 @@ async def pstream(interaction: Interaction, member: discord.Member = None):
 # -------------------------
 @bot.tree.command(name="link", description="نمایش لینک دعوت استریمر")
 async def link(interaction: Interaction):
-    uid = str(interaction.user.id)
+    uid = interaction.user.id
     if not is_streamer(interaction.user):
         await interaction.response.send_message("❌ شما استریمر نیستید.",
                                                 ephemeral=True)
         return
-    streamer = stream_data.get(uid)
+    streamer = store.streamer(uid)
     if not streamer:
         await interaction.response.send_message("❌ اطلاعات استریمر یافت نشد.",
                                                 ephemeral=True)
         return
     await interaction.response.send_message(
-        f"🌐 لینک دعوت شما: {streamer.get('invite_link')}", ephemeral=True)
+        f"🌐 لینک دعوت شما: {streamer.invite_link}", ephemeral=True)
 
 
 # -------------------------
@@ -265,27 +2225,22 @@ class AddStreamerModal(Modal):
         self.add_item(self.stream_link)
 
     async def on_submit(self, interaction: Interaction):
-        uid = str(interaction.user.id)
+        uid = interaction.user.id
         # برای simplicity، فرض می‌کنیم user فیلد ID را وارد می‌کند
         streamer_id = self.user.value.strip()
         try:
-            int(streamer_id)
+            streamer_id = int(streamer_id)
         except:
             await interaction.response.send_message("❌ ID استریمر معتبر نیست.",
                                                     ephemeral=True)
             return
 
-        stream_data[streamer_id] = {
-            "banner_url": self.banner.value.strip(),
-            "invite_link": self.invite_link.value.strip(),
-            "stream_link": self.stream_link.value.strip(),
-            "streams_count": 0,
-            "violations": 0,
-            "money": 0,
-            "invite_count": 0,
-            "start_date": datetime.now(timezone.utc).isoformat()
-        }
-        await update_stream()
+        store.set_streamer(
+            streamer_id,
+            Streamer(banner_url=self.banner.value.strip(),
+                     invite_link=self.invite_link.value.strip(),
+                     stream_link=self.stream_link.value.strip(),
+                     start_ts=now_ts()))
         await interaction.response.send_message(
             f"✅ استریمر {streamer_id} ثبت شد.", ephemeral=True)
 
@@ -312,42 +2267,31 @@ class StartStreamView(View):
 
     @discord.ui.button(label="استارت استریم", style=discord.ButtonStyle.green)
     async def start_cb(self, interaction: Interaction, button: Button):
-        streamer = stream_data.get(self.streamer_id)
+        streamer = store.streamer(self.streamer_id)
         if not streamer:
             await interaction.response.send_message(
                 "❌ اطلاعات استریمر یافت نشد.", ephemeral=True)
             return
         uid = self.streamer_id
         # افزایش تعداد استریم
-        streamer["streams_count"] = streamer.get("streams_count", 0) + 1
+        streamer.streams_count += 1
+        store.touch_streamer(uid)
         # افزایش پول
-        data.setdefault("wallet",
-                        {})[uid] = data.get("wallet", {}).get(uid, 0) + 1000
-        await update_data()
-        await update_stream()
+        await ledger.credit(uid, 1000, "stream")
         # ارسال پیام در چنل اخبار
         embed = discord.Embed(
             title="استارت استریم",
             description=f"استریمر <@{uid}> شروع به استریم کرده است!",
             color=discord.Color.green())
-        embed.set_image(url=streamer.get("banner_url"))
-        embed.add_field(name="لینک استریم", value=streamer.get("stream_link"))
+        embed.set_image(url=streamer.banner_url)
+        embed.add_field(name="لینک استریم", value=streamer.stream_link)
         await self.news_channel.send(embed=embed)
         await interaction.response.send_message(
             "✅ استریم شروع شد و پول اضافه شد.", ephemeral=True)
         self.stop()
 
 
-user_wallet = data.get("wallet", {})
-user_subscription = data.get("subscription", {})
-user_warns = data.get("warns", {})
-user_badges = data.get("badges", {})
-contests = data.get("contests", {})
-server_settings = data.get("server_settings", {})
-
 # runtime objects
-active_timers = {}  # user_id -> message
-active_contest_tasks = {}  # contest_id -> task
 
 
 
@@ -365,7 +2309,7 @@ def is_admin_member(member: discord.Member) -> bool:
 
 
 def generate_unique_badge():
-    existing = set(user_badges.values())
+    existing = set(store.section("badges").values())
     while True:
         number = random.randint(2000, 9999)
         if number not in existing:
@@ -393,7 +2337,7 @@ class EditStreamerModal(Modal):
         self.add_item(self.input_field)
 
     async def on_submit(self, interaction: Interaction):
-        streamer = stream_data.get(self.streamer_id)
+        streamer = store.streamer(self.streamer_id)
         if not streamer:
             await interaction.response.send_message("❌ استریمر یافت نشد.",
                                                     ephemeral=True)
@@ -407,8 +2351,8 @@ class EditStreamerModal(Modal):
                 await interaction.response.send_message(
                     "❌ مقدار عددی معتبر نیست.", ephemeral=True)
                 return
-        streamer[self.field_name] = value
-        await update_stream()
+        setattr(streamer, self.field_name, value)
+        store.touch_streamer(self.streamer_id)
         await interaction.response.send_message(
             f"✅ {self.field_name} بروزرسانی شد.", ephemeral=True)
 
@@ -422,11 +2366,9 @@ async def vstream(interaction: Interaction):
         return
 
     view = View()
-    for uid, streamer in stream_data.items():
-        if not uid.isdigit():
-            continue
-        user = bot.get_user(int(uid))
-        label = user.name if user else uid
+    for uid, streamer in store.streamers():
+        user = bot.get_user(uid)
+        label = user.name if user else str(uid)
         btn = Button(label=label, style=discord.ButtonStyle.blurple)
 
         async def button_callback(btn_interaction, streamer_id=uid):
@@ -445,7 +2387,7 @@ async def vstream(interaction: Interaction):
                 fbtn.callback = fbtn_cb
                 field_view.add_item(fbtn)
             await btn_interaction.response.send_message(
-                f"📋 ویرایش اطلاعات {streamer.get('banner_url')}",
+                f"📋 ویرایش اطلاعات {streamer.banner_url}",
                 view=field_view,
                 ephemeral=True)
 
@@ -480,17 +2422,9 @@ async def sets(interaction: discord.Interaction, channel: discord.TextChannel):
     msg = await channel.send(embed=embed, view=view)
 
     # ذخیره message_id پیام استارت در stream.json
-    guild_id = str(interaction.guild.id)
-    if guild_id in stream_data.get("start_stream_messages", {}):
-        stream_data["start_stream_messages"][guild_id]["message_id"] = msg.id
-    else:
-        # اگر قبلا setstart اجرا نشده بود
-        stream_data.setdefault("start_stream_messages", {})[guild_id] = {
-            "channel_id": None,
-            "message_id": msg.id
-        }
-
-    await update_stream()
+    guild_id = interaction.guild.id
+    info = store.stream_guild(guild_id) or {"channel_id": None}  # اگر قبلا setstart اجرا نشده بود
+    store.set_stream_guild(guild_id, {**info, "message_id": msg.id})
     await interaction.response.send_message(
         f"✅ پیام استارت استریم ارسال شد در {channel.mention}", ephemeral=True)
 
@@ -510,42 +2444,36 @@ class StartStreamView(View):
                        custom_id="start_stream_button")
     async def start_stream(self, interaction: discord.Interaction,
                            button: discord.ui.Button):
+        await respond_once(interaction, "start_stream",
+                           lambda: self._start(interaction))
+
+    async def _start(self, interaction: discord.Interaction):
         user = interaction.user
-        uid = str(user.id)
+        uid = user.id
 
         # چک کردن رول استریمر
         if not is_streamer(user):
-            await interaction.response.send_message("❌ شما استریمر نیستید.",
-                                                    ephemeral=True)
-            return
+            return "❌ شما استریمر نیستید."
 
         # گرفتن اطلاعات استریمر
-        streamer = stream_data.get(uid)
+        streamer = store.streamer(uid)
         if not streamer:
-            await interaction.response.send_message(
-                "❌ اطلاعات استریمر یافت نشد.", ephemeral=True)
-            return
+            return "❌ اطلاعات استریمر یافت نشد."
 
         # افزایش تعداد استریم و پول
-        streamer["streams_count"] = streamer.get("streams_count", 0) + 1
-        data.setdefault("wallet",
-                        {})[uid] = data.get("wallet", {}).get(uid, 0) + 1000
-        await update_data()
-        await update_stream()
+        streamer.streams_count += 1
+        store.touch_streamer(uid)
+        await ledger.credit(uid, 1000, "stream")
 
         # دریافت کانال اخبار استارت از stream.json
-        guild_id = str(interaction.guild.id)
-        guild_info = stream_data.get("start_stream_messages", {}).get(guild_id)
+        guild_id = interaction.guild.id
+        guild_info = store.stream_guild(guild_id)
         if not guild_info or not guild_info.get("channel_id"):
-            await interaction.response.send_message(
-                "❌ کانال اخبار استارت استریم ثبت نشده.", ephemeral=True)
-            return
+            return "❌ کانال اخبار استارت استریم ثبت نشده."
 
         news_channel = bot.get_channel(guild_info["channel_id"])
-        if not news_channel:
-            await interaction.response.send_message("❌ کانال اخبار یافت نشد.",
-                                                    ephemeral=True)
-            return
+        if not news_channel:
+            return "❌ کانال اخبار یافت نشد."
 
         # ارسال پیام اطلاع‌رسانی در کانال اخبار
         embed = discord.Embed(
@@ -553,9 +2481,9 @@ class StartStreamView(View):
             description=
             f"استریمر {user.mention} شروع به استریم کرده است!\nتو هنوز نشستی و بیکاری؟ بیا تو استریم یکم حال کنیم!",
             color=discord.Color.blurple())
-        embed.set_image(url=streamer.get("banner_url"))
+        embed.set_image(url=streamer.banner_url)
         embed.add_field(name="لینک استریم",
-                        value=streamer.get("stream_link"),
+                        value=streamer.stream_link,
                         inline=False)
         embed.add_field(name="پیام پایانی",
                         value="منتظرت تو استریم هستم!",
@@ -564,13 +2492,11 @@ class StartStreamView(View):
         view = View()
         enter_button = Button(label="ورود به استریمر",
                               style=discord.ButtonStyle.link,
-                              url=streamer.get("stream_link"))
+                              url=streamer.stream_link)
         view.add_item(enter_button)
 
         await news_channel.send(embed=embed, view=view)
-        await interaction.response.send_message(
-            "✅ استریم شما شروع شد و پیام اطلاع‌رسانی ارسال شد.",
-            ephemeral=True)
+        return "✅ استریم شما شروع شد و پیام اطلاع‌رسانی ارسال شد."
 
 
 # -------------------------
@@ -581,9 +2507,8 @@ class StartStreamView(View):
 # وقتی می‌خوای پیام استارت را بفرستی
 @bot.tree.command(name="start_msg", description="ارسال پیام استارت استریم")
 async def start_msg(interaction: Interaction):
-    gid = str(interaction.guild.id)
-    news_channel_id = server_settings.get(gid,
-                                          {}).get("stream_news_channel_id")
+    gid = interaction.guild.id
+    news_channel_id = store.guild_settings(gid).get("stream_news_channel_id")
     news_channel = bot.get_channel(news_channel_id)
     if not news_channel:
         await interaction.response.send_message(
@@ -613,15 +2538,13 @@ async def setstart(interaction: discord.Interaction,
             "❌ فقط ادمین‌ها می‌توانند این فرمان را اجرا کنند.", ephemeral=True)
         return
 
-    guild_id = str(interaction.guild.id)
+    guild_id = interaction.guild.id
 
     # جایگزین کردن کانال قبلی اگر وجود دارد
-    stream_data.setdefault("start_stream_messages", {})
-    stream_data["start_stream_messages"][guild_id] = {
+    store.set_stream_guild(guild_id, {
         "channel_id": channel.id,
         "message_id": None  # بعداً هنگام ارسال پیام /sets آپدیت می‌شود
-    }
-    await update_stream()
+    })
 
     await interaction.response.send_message(
         f"✅ کانال اخبار استارت استریم تنظیم شد: {channel.mention}",
@@ -634,20 +2557,19 @@ async def setstart(interaction: discord.Interaction,
 
 
 async def send_start_stream_message(user: discord.Member):
-    uid = str(user.id)
+    uid = user.id
     if not is_streamer(user):
         return
-    gid = str(user.guild.id)
-    news_channel_id = server_settings.get(gid,
-                                          {}).get("stream_news_channel_id")
-    start_channel_id = server_settings.get(gid,
-                                           {}).get("stream_start_channel_id")
+    gid = user.guild.id
+    settings = store.guild_settings(gid)
+    news_channel_id = settings.get("stream_news_channel_id")
+    start_channel_id = settings.get("stream_start_channel_id")
     news_channel = bot.get_channel(news_channel_id)
     start_channel = bot.get_channel(start_channel_id)
     if not start_channel:
         return
 
-    streamer = stream_data.get(uid)
+    streamer = store.streamer(uid)
     view = StartStreamView(uid, news_channel)
 
     embed = discord.Embed(
@@ -655,7 +2577,7 @@ async def send_start_stream_message(user: discord.Member):
         description=
         "من استریمر هستم و قوانین را قبول دارم.\nبرای شروع استریم روی دکمه زیر کلیک کنید.",
         color=discord.Color.green())
-    embed.set_image(url=streamer.get("banner_url"))
+    embed.set_image(url=streamer.banner_url)
     await start_channel.send(embed=embed, view=view)
 
 
@@ -672,25 +2594,25 @@ async def ws(interaction: Interaction, member: discord.Member, number: int,
         await interaction.response.send_message(
             "❌ فقط ادمین‌ها می‌توانند این فرمان را اجرا کنند.", ephemeral=True)
         return
-    uid = str(member.id)
-    if uid not in stream_data:
+    uid = member.id
+    streamer = store.streamer(uid)
+    if not streamer:
         await interaction.response.send_message("❌ این کاربر استریمر نیست.",
                                                 ephemeral=True)
         return
 
-    streamer = stream_data[uid]
     if action.lower() == "add":
-        streamer["violations"] = min(3, streamer.get("violations", 0) + number)
+        streamer.violations = min(3, streamer.violations + number)
     elif action.lower() == "rev":
-        streamer["violations"] = max(0, streamer.get("violations", 0) - number)
+        streamer.violations = max(0, streamer.violations - number)
     else:
         await interaction.response.send_message(
             "❌ action باید add یا rev باشد.", ephemeral=True)
         return
 
-    await update_stream()
+    store.touch_streamer(uid)
     await interaction.response.send_message(
-        f"✅ تعداد تخلفات بروزرسانی شد: {streamer['violations']}",
+        f"✅ تعداد تخلفات بروزرسانی شد: {streamer.violations}",
         ephemeral=True)
 
 
@@ -723,28 +2645,19 @@ class AddStreamerModal(Modal):
                                                     ephemeral=True)
             return
 
-        # ثبت اطلاعات در stream_data
-        stream_data[streamer_id] = {
-            "banner_url": self.banner.value.strip(),
-            "invite_link": self.invite_link.value.strip(),
-            "stream_link": self.stream_link.value.strip(),
-            "streams_count": 0,
-            "violations": 0,
-            "money": 0,
-            "invite_count": 0,
-            "start_date": datetime.now(timezone.utc).isoformat(),
-            "invite_code": generate_invite_code()
-        }
+        # ثبت اطلاعات استریمر
+        store.set_streamer(
+            int(streamer_id),
+            Streamer(banner_url=self.banner.value.strip(),
+                     invite_link=self.invite_link.value.strip(),
+                     stream_link=self.stream_link.value.strip(),
+                     start_ts=now_ts(),
+                     invite_code=generate_invite_code()))
 
-        await update_stream()
         await interaction.response.send_message(
             f"✅ استریمر {streamer_id} ثبت شد.", ephemeral=True)
 
 
-async def save_user_data():
-    await update_data()
-
-
 # -------------------------
 # مدیریت ورود کاربران
 # -------------------------
@@ -752,11 +2665,11 @@ async def save_user_data():
 
 @bot.event
 async def on_member_join(member: discord.Member):
-    uid = str(member.id)
+    uid = member.id
 
     # 1️⃣ ایجاد بج جدید در صورت نبود
-    if uid not in user_badges:
-        user_badges[uid] = generate_unique_badge()
+    if store.get("badges", uid) is None:
+        store.set("badges", uid, generate_unique_badge())
 
     # 2️⃣ بررسی کد دعوت
     # فرض می‌کنیم که member.guild یا member.pending اطلاعات کد دعوت را در اختیار دارد
@@ -770,23 +2683,16 @@ async def on_member_join(member: discord.Member):
                 used_invite = inv
                 break
         if used_invite:
-            for sid, streamer in stream_data.items():
-                if used_invite.code == streamer.get("invite_code"):
+            for sid, streamer in store.streamers():
+                if used_invite.code == streamer.invite_code:
                     # افزایش پول و تعداد دعوتی
-                    data.setdefault(
-                        "wallet",
-                        {})[sid] = data.get("wallet", {}).get(sid, 0) + 1000
-                    streamer["invite_count"] = streamer.get("invite_count",
-                                                            0) + 1
-                    await update_data()
-                    await update_stream()
+                    await ledger.credit(sid, 1000, "invite")
+                    streamer.invite_count += 1
+                    store.touch_streamer(sid)
                     break
     except Exception:
         pass
 
-    await update_data()
-    await update_stream()
-
 
 # -------------------------
 # رویدادها
@@ -803,34 +2709,129 @@ async def on_ready():
 
 @bot.event
 async def on_member_join(member: discord.Member):
-    uid = str(member.id)
-    if uid not in user_badges:
-        user_badges[uid] = generate_unique_badge()
-        await update_data()
+    uid = member.id
+    badge = store.get("badges", uid)
+    if badge is None:
+        badge = store.set("badges", uid, generate_unique_badge())
     # optional: try to change nickname
     try:
-        await member.edit(nick=f"{user_badges[uid]} | {member.name}")
+        await member.edit(nick=f"{badge} | {member.name}")
     except Exception:
         pass
 
 
 # -------------------------
-# حلقه پاداش ویس (هر 60 ثانیه) — نگه میداره رفتار قبلی
+# پاداش ویس بر اساس جلسه (on_voice_state_update)
 # -------------------------
-async def voice_check_loop():
-    await bot.wait_until_ready()
-    while not bot.is_closed():
-        try:
-            for g in bot.guilds:
-                for vc in g.voice_channels:
-                    for m in vc.members:
-                        if not m.bot:
-                            uid = str(m.id)
-                            user_wallet[uid] = user_wallet.get(uid, 0) + 2
-            await update_data()
-        except Exception as e:
-            print("⚠️ voice_check_loop error:", e)
-        await asyncio.sleep(60)
+VOICE_COINS_PER_MINUTE = int(os.environ.get("VOICE_COINS_PER_MINUTE", "2"))
+VOICE_SKIP_AFK = os.environ.get("VOICE_SKIP_AFK", "1") == "1"
+VOICE_SKIP_DEAF = os.environ.get("VOICE_SKIP_DEAF", "0") == "1"
+VOICE_SKIP_ALONE = os.environ.get("VOICE_SKIP_ALONE", "0") == "1"
+
+
+class VoiceTracker:
+    """
+    One session per (guild, member) while the member is eligible to earn.
+    Coins are computed from the session length when it closes (leave, move to
+    AFK, deafen, left alone...) or when the member spends, and go through
+    store.rewards, which commits them to wallets in batches. Work happens
+    only on voice state changes; store.balance() adds pending() on top.
+    """
+
+    def __init__(self):
+        self.sessions = {}  # uid -> {guild_id: monotonic start}
+        self.carry = {}  # uid -> ثانیه‌های باقیمانده‌ای که هنوز سکه نشده
+
+    @staticmethod
+    def eligible(member, state):
+        if member.bot or state is None or state.channel is None:
+            return False
+        if VOICE_SKIP_AFK and state.afk:
+            return False
+        if VOICE_SKIP_DEAF and (state.self_deaf or state.deaf):
+            return False
+        if VOICE_SKIP_ALONE and sum(
+                1 for m in state.channel.members if not m.bot) < 2:
+            return False
+        return True
+
+    def refresh(self, member, state):
+        uid, gid = member.id, member.guild.id
+        if self.eligible(member, state):
+            self.sessions.setdefault(uid, {}).setdefault(gid, time.monotonic())
+        elif gid in self.sessions.get(uid, ()):
+            self.close(uid, gid)
+
+    def close(self, uid, gid):
+        starts = self.sessions[uid]
+        self._credit(uid, time.monotonic() - starts.pop(gid))
+        if not starts:
+            del self.sessions[uid]
+
+    def _open_seconds(self, uid, now):
+        return sum(now - started for started in self.sessions.get(uid, {}).values())
+
+    def pending(self, uid):
+        """سکه‌ی جلسه‌های باز که هنوز ثبت نشده (برای نمایش موجودی)."""
+        seconds = self._open_seconds(uid, time.monotonic()) + self.carry.get(uid, 0)
+        return int(seconds * VOICE_COINS_PER_MINUTE // 60)
+
+    def settle(self, uid):
+        """پیش از خرج کردن: جلسه‌های باز کاربر تا این لحظه ثبت و ادامه پیدا می‌کنند."""
+        starts = self.sessions.get(uid)
+        if not starts:
+            return
+        now = time.monotonic()
+        seconds = self._open_seconds(uid, now)
+        for gid in starts:
+            starts[gid] = now
+        self._credit(uid, seconds)
+
+    def _credit(self, uid, seconds):
+        seconds += self.carry.pop(uid, 0)
+        coins = int(seconds * VOICE_COINS_PER_MINUTE // 60)
+        if coins:
+            store.rewards.add(uid, coins, "voice")
+            seconds -= coins * 60 / VOICE_COINS_PER_MINUTE
+        if seconds > 0:
+            self.carry[uid] = seconds
+
+    def on_update(self, member, before, after):
+        self.refresh(member, after)
+        if VOICE_SKIP_ALONE:
+            # تنها ماندن / تنها نبودن بقیه‌ی اعضای همان کانال‌ها هم عوض می‌شود
+            for channel in {before.channel, after.channel} - {None}:
+                for m in channel.members:
+                    if m.id != member.id:
+                        self.refresh(m, m.voice)
+
+    def bootstrap(self, guilds):
+        """بعد از اتصال (یا اتصال دوباره) جلسه‌ها را با وضعیت فعلی هم‌گام می‌کند."""
+        seen = set()
+        for g in guilds:
+            for vc in g.voice_channels:
+                for m in vc.members:
+                    seen.add((g.id, m.id))
+                    self.refresh(m, m.voice)
+        for uid, starts in list(self.sessions.items()):
+            for gid in [g for g in starts if (g, uid) not in seen]:
+                self.close(uid, gid)
+
+    def close_all(self):
+        for uid, starts in list(self.sessions.items()):
+            for gid in list(starts):
+                self.close(uid, gid)
+
+
+voice_tracker = VoiceTracker()
+store.voice = voice_tracker
+
+
+@bot.event
+async def on_voice_state_update(member: discord.Member,
+                                before: discord.VoiceState,
+                                after: discord.VoiceState):
+    voice_tracker.on_update(member, before, after)
 
 
 # -------------------------
@@ -838,8 +2839,8 @@ async def voice_check_loop():
 # -------------------------
 @bot.tree.command(name="pol", description="نمایش موجودی سکه شما")
 async def pol(interaction: discord.Interaction):
-    uid = str(interaction.user.id)
-    bal = user_wallet.get(uid, 0)
+    uid = interaction.user.id
+    bal = store.balance(uid)
     await interaction.response.send_message(f"💰 موجودی شما: {bal} سکه",
                                             ephemeral=True)
 
@@ -847,30 +2848,20 @@ async def pol(interaction: discord.Interaction):
 @bot.tree.command(name="prof", description="نمایش پروفایل شما")
 async def prof(interaction: discord.Interaction):
     user = interaction.user
-    uid = str(user.id)
-
-    # خواندن جدید از فایل
-    d = load_data()
+    uid = user.id
 
-    user_wallet_data = d.get("wallet", {})
-    user_subscription_data = d.get("subscription", {})
-    user_warns_data = d.get("warns", {})
-    user_badges_data = d.get("badges", {})
-
-    badge = user_badges_data.get(uid, "ثبت نشده")
-    coins = user_wallet_data.get(uid, 0)
-    warns = user_warns_data.get(uid, 0)
+    badge = store.get("badges", uid, "ثبت نشده")
+    coins = store.balance(uid)
+    warns = store.get("warns", uid, 0)
+    sub = store.get("subscription", uid)
 
     sub_status = "❌ ندارد"
     days_left = "—"
-    if uid in user_subscription_data:
-        start = datetime.fromisoformat(user_subscription_data[uid])
-        end = start + timedelta(days=30)
-        now = datetime.now(timezone.utc)
-        remaining = end - now
-        if remaining.total_seconds() > 0:
+    if sub:
+        remaining = sub.expires_ts - now_ts()
+        if remaining > 0:
             sub_status = "✅ فعال"
-            days_left = f"{remaining.days} روز"
+            days_left = f"{remaining // DAY} روز"
         else:
             sub_status = "⛔ منقضی شده"
 
@@ -890,69 +2881,279 @@ async def prof(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
+# -------------------------
+# لیدربورد: /top و /rank
+# -------------------------
+TOP_PAGE_SIZE = 10
+# نام در فرمان -> (لیدربورد در store، واحد)
+BOARD_NAMES = {
+    "coins": ("wallet", "سکه"),
+    "streams": ("streams", "استریم"),
+    "invites": ("invites", "دعوت"),
+}
+
+
+def top_embed(board_key, page):
+    board_name, unit = BOARD_NAMES[board_key]
+    board = store.boards[board_name]
+    pages = max(1, -(-len(board) // TOP_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * TOP_PAGE_SIZE
+    lines = [
+        f"**{start + i + 1}.** <@{uid}> — {score} {unit}"
+        for i, (uid, score) in enumerate(board.page(start, TOP_PAGE_SIZE))
+    ]
+    embed = discord.Embed(title=f"🏆 برترین‌ها ({unit})",
+                          description="\n".join(lines) or "هنوز کسی ثبت نشده.",
+                          color=discord.Color.gold())
+    embed.set_footer(text=f"صفحه {page} از {pages}")
+    return embed, page, pages
+
+
+class TopView(View):
+
+    def __init__(self, board_key, page, pages):
+        super().__init__(timeout=120)
+        self.board_key = board_key
+        self.page = page
+        self.prev_btn.disabled = page <= 1
+        self.next_btn.disabled = page >= pages
+
+    async def _show(self, interaction: discord.Interaction, page):
+        embed, page, pages = top_embed(self.board_key, page)
+        await interaction.response.edit_message(
+            embed=embed, view=TopView(self.board_key, page, pages))
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.gray)
+    async def prev_btn(self, interaction: discord.Interaction,
+                       button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.gray)
+    async def next_btn(self, interaction: discord.Interaction,
+                       button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+
+@bot.tree.command(name="top", description="نمایش برترین‌ها")
+@app_commands.describe(board="coins / streams / invites", page="شماره صفحه")
+async def top_cmd(interaction: discord.Interaction, board: str = "coins",
+                  page: int = 1):
+    board = board.lower()
+    if board not in BOARD_NAMES:
+        await interaction.response.send_message(
+            "❌ board باید coins / streams / invites باشد.", ephemeral=True)
+        return
+    embed, page, pages = top_embed(board, page)
+    await interaction.response.send_message(embed=embed,
+                                            view=TopView(board, page, pages),
+                                            ephemeral=True)
+
+
+@bot.tree.command(name="rank", description="نمایش رتبه شما")
+@app_commands.describe(member="کاربر (پیش‌فرض: خودتان)",
+                       board="coins / streams / invites")
+async def rank_cmd(interaction: discord.Interaction,
+                   member: discord.Member = None, board: str = "coins"):
+    board = board.lower()
+    if board not in BOARD_NAMES:
+        await interaction.response.send_message(
+            "❌ board باید coins / streams / invites باشد.", ephemeral=True)
+        return
+    user = member or interaction.user
+    board_name, unit = BOARD_NAMES[board]
+    lb = store.boards[board_name]
+    rank = lb.rank(user.id)
+    if rank is None:
+        await interaction.response.send_message(
+            f"ℹ️ {user.mention} در این رتبه‌بندی ثبت نشده.", ephemeral=True)
+        return
+    await interaction.response.send_message(
+        f"🏅 رتبه {user.mention}: **{rank}** از {len(lb)} — {lb.scores[user.id]} {unit}",
+        ephemeral=True)
+
+
+# -------------------------
+# تاریخچه تراکنش‌ها: /history
+# -------------------------
+HISTORY_PAGE_SIZE = 10
+
+
+def history_embed(user, page):
+    # جدیدترین‌ها اول
+    entries = store.get("history", user.id, [])[::-1]
+    pages = max(1, -(-len(entries) // HISTORY_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * HISTORY_PAGE_SIZE
+    lines = [
+        f"<t:{ts}:R> — **{amount:+}** سکه ({HISTORY_SOURCES.get(source, source)})"
+        for ts, amount, source in entries[start:start + HISTORY_PAGE_SIZE]
+    ]
+    embed = discord.Embed(title=f"📜 تاریخچه سکه‌های {user.display_name}",
+                          description="\n".join(lines) or "هنوز تراکنشی ثبت نشده.",
+                          color=discord.Color.blurple())
+    embed.add_field(name="💰 موجودی فعلی", value=str(store.balance(user.id)))
+    embed.set_footer(text=f"صفحه {page} از {pages}")
+    return embed, page, pages
+
+
+class HistoryView(View):
+
+    def __init__(self, user, page, pages):
+        super().__init__(timeout=120)
+        self.user = user
+        self.page = page
+        self.prev_btn.disabled = page <= 1
+        self.next_btn.disabled = page >= pages
+
+    async def _show(self, interaction: discord.Interaction, page):
+        embed, page, pages = history_embed(self.user, page)
+        await interaction.response.edit_message(
+            embed=embed, view=HistoryView(self.user, page, pages))
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.gray)
+    async def prev_btn(self, interaction: discord.Interaction,
+                       button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.gray)
+    async def next_btn(self, interaction: discord.Interaction,
+                       button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+
+@bot.tree.command(name="history", description="نمایش تاریخچه سکه‌ها")
+@app_commands.describe(member="کاربر (فقط ادمین‌ها؛ پیش‌فرض: خودتان)",
+                       page="شماره صفحه")
+async def history_cmd(interaction: discord.Interaction,
+                      member: discord.Member = None, page: int = 1):
+    user = member or interaction.user
+    if user.id != interaction.user.id and not is_admin_member(interaction.user):
+        await interaction.response.send_message(
+            "❌ فقط ادمین‌ها می‌توانند تاریخچه دیگران را ببینند.", ephemeral=True)
+        return
+    embed, page, pages = history_embed(user, page)
+    await interaction.response.send_message(embed=embed,
+                                            view=HistoryView(user, page, pages),
+                                            ephemeral=True)
+
+
+# -------------------------
+# گزارش اقتصاد: /economy
+# -------------------------
+# نام در فرمان -> (بازه در telemetry، عنوان)
+ECONOMY_PERIODS = {
+    "hour": ("minute", "یک ساعت اخیر"),
+    "day": ("hour", "۲۴ ساعت اخیر"),
+    "month": ("day", "۳۰ روز اخیر"),
+    "all": ("all", "از ابتدا"),
+}
+
+
+@bot.tree.command(name="economy", description="گزارش ورود و خروج سکه (admin فقط)")
+@app_commands.describe(period="hour / day / month / all")
+async def economy_cmd(interaction: discord.Interaction, period: str = "day"):
+    if not is_admin_member(interaction.user):
+        await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
+        return
+    period = period.lower()
+    if period not in ECONOMY_PERIODS:
+        await interaction.response.send_message(
+            "❌ period باید hour / day / month / all باشد.", ephemeral=True)
+        return
+    window, title = ECONOMY_PERIODS[period]
+    flows = store.telemetry.window(window)
+    minted = sum(m for m, _ in flows.values())
+    burned = sum(b for _, b in flows.values())
+    lines = [
+        f"**{HISTORY_SOURCES.get(src, src)}** — ➕ {m} / ➖ {b}"
+        for src, (m, b) in sorted(flows.items(), key=lambda kv: -(kv[1][0] + kv[1][1]))
+    ]
+    embed = discord.Embed(title=f"💹 جریان سکه ({title})",
+                          description="\n".join(lines) or "تراکنشی ثبت نشده.",
+                          color=discord.Color.green())
+    embed.add_field(name="➕ ساخته‌شده", value=str(minted), inline=True)
+    embed.add_field(name="➖ سوزانده‌شده", value=str(burned), inline=True)
+    embed.add_field(name="📊 خالص", value=f"{minted - burned:+}", inline=True)
+    embed.add_field(name="💰 کل سکه‌ها",
+                    value=str(store.supply), inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
 # -------------------------
 # تایمر 20 روزه: تابع اجرایی قابل فراخوانی
 # -------------------------
+TIMER_DAYS = 20
+
+
+def timer_content(uid, end_ts):
+    """متن پیام تایمر؛ ثانیه‌ها فقط در ساعت آخر (تا پیام بی‌دلیل عوض نشود)."""
+    remaining = end_ts - now_ts()
+    if remaining <= 0:
+        return f"⏳ تایمر <@{uid}>: زمان به پایان رسید!"
+    days, rem = divmod(remaining, DAY)
+    hours, rem = divmod(rem, 3600)
+    minutes, seconds = divmod(rem, 60)
+    clock = (f"{hours:02}:{minutes:02}:{seconds:02}" if remaining < 3600
+             else f"{hours:02}:{minutes:02}")
+    progress = min(max(TIMER_DAYS - days, 0), TIMER_DAYS)
+    bar = "🟩" * progress + "🟥" * (TIMER_DAYS - progress)
+    return (f"⏳ باقی‌مانده برای <@{uid}>: {days} روز، {clock}\n"
+            f"{bar} ({progress}/{TIMER_DAYS} روز)")
+
+
+def timer_message(timer):
+    """هندل پیام بدون درخواست به API (ویرایش فقط وقتی لازم شد)."""
+    channel = bot.get_channel(timer.channel_id)
+    return channel.get_partial_message(timer.message_id) if channel else None
+
+
+def track_timer(uid, message, end_ts):
+
+    def finish():
+        timer = store.get("timers", uid)
+        if timer and timer.message_id == message.id:
+            store.pop("timers", uid)
+
+    refresher.track(("timer", uid), message,
+                    lambda: timer_content(uid, end_ts),
+                    lambda content: {"content": content},
+                    end_ts, on_done=finish)
+
+
+def resume_timers():
+    """بعد از اتصال: تایمرهای ذخیره‌شده دوباره به پیامشان وصل می‌شوند."""
+    for uid, timer in list(store.section("timers").items()):
+        if ("timer", uid) in refresher.entries:
+            continue
+        message = timer_message(timer)
+        if message is not None:
+            track_timer(uid, message, timer.end_ts)
+        else:
+            # کانال پیام دیگر وجود ندارد
+            store.pop("timers", uid)
+            scheduler.cancel("timer_warning", uid)
+
+
 async def start_timer_for(target_member: discord.Member,
                           channel: discord.TextChannel):
-    """شروع/ریست تایمر 20 روزه برای target_member و ارسال/آپدیت پیام در channel"""
-    uid = str(target_member.id)
-    start_time = datetime.now(timezone.utc)
-    user_subscription[uid] = start_time.isoformat()
-    await update_data()
-
-    duration = timedelta(days=20)
-    end_time = start_time + duration
-    warning_sent = False
+    """شروع/ریست تایمر 20 روزه برای target_member و ارسال پیام زنده در channel"""
+    uid = target_member.id
+    start_ts = now_ts()
+    sub = store.set("subscription", uid, Subscription(start_ts))
+    scheduler.schedule("subscription", uid, sub.expires_ts)
+    end_ts = start_ts + TIMER_DAYS * DAY
 
     try:
         msg = await channel.send(
             f"⏳ تایمر {target_member.mention} در حال شروع است...")
-        active_timers[uid] = msg
     except Exception:
         return
 
-    while True:
-        now = datetime.now(timezone.utc)
-        remaining = end_time - now
-
-        if remaining.total_seconds() <= 0:
-            try:
-                await msg.edit(
-                    content=
-                    f"⏳ تایمر {target_member.mention}: زمان به پایان رسید!")
-            except Exception:
-                pass
-            active_timers.pop(uid, None)
-            break
-
-        days = remaining.days
-        hours, rem = divmod(remaining.seconds, 3600)
-        minutes, seconds = divmod(rem, 60)
-        progress = 20 - days
-        if progress < 0:
-            progress = 0
-        if progress > 20:
-            progress = 20
-        bar = "🟩" * progress + "🟥" * (20 - progress)
-
-        content = (
-            f"⏳ باقی‌مانده برای {target_member.mention}: {days} روز، {hours:02}:{minutes:02}:{seconds:02}\n"
-            f"{bar} ({progress}/20 روز)")
-        try:
-            await msg.edit(content=content)
-        except Exception:
-            pass
-
-        if days == 3 and not warning_sent:
-            try:
-                await channel.send(
-                    f"⚠️ فقط ۳ روز باقی مانده برای {target_member.mention}!")
-            except Exception:
-                pass
-            warning_sent = True
-
-        await asyncio.sleep(10)  # update every 5 seconds
+    store.set("timers", uid, Timer(channel.id, msg.id, end_ts))
+    # هشدار وقتی «۳ روز و چند ساعت» مانده
+    scheduler.schedule("timer_warning", uid, end_ts - 4 * DAY)
+    track_timer(uid, msg, end_ts)
 
 
 # /timeout command (admin-only)
@@ -978,9 +3179,11 @@ async def rtime_cmd(interaction: discord.Interaction,
             "❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
         return
     target = member or interaction.user
-    uid = str(target.id)
+    uid = target.id
     # cancel existing timer message if present
-    msg = active_timers.pop(uid, None)
+    timer = store.pop("timers", uid)
+    await refresher.untrack(("timer", uid))
+    msg = timer_message(timer) if timer else None
     if msg:
         try:
             await msg.edit(
@@ -1005,30 +3208,82 @@ async def pay_cmd(interaction: discord.Interaction, member: discord.Member, amou
         await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
         return
 
-    uid = str(member.id)
-
-    # ✅ لود فایل اصلی
-    d = load_data()
-    wallets = d.setdefault("wallet", {})
-
-    # گرفتن موجودی فعلی
-    current = wallets.get(uid, 0)
+    uid = member.id
 
     if action.lower() == "add":
-        wallets[uid] = current + amount
-        msg = f"✅ {amount} سکه به {member.mention} اضافه شد. (کل: {wallets[uid]})"
+        total = await ledger.credit(uid, amount, "admin")
+        msg = f"✅ {amount} سکه به {member.mention} اضافه شد. (کل: {total})"
     elif action.lower() == "rev":
-        wallets[uid] = max(0, current - amount)
-        msg = f"✅ {amount} سکه از {member.mention} کم شد. (کل: {wallets[uid]})"
+        total = await ledger.credit(uid, -amount, "admin")
+        msg = f"✅ {amount} سکه از {member.mention} کم شد. (کل: {total})"
     else:
         await interaction.response.send_message("❌ پارامتر action باید `add` یا `rev` باشد.", ephemeral=True)
         return
 
-    # ✅ ذخیره در فایل
-    await save_data_async(d)
-
     await interaction.response.send_message(msg, ephemeral=True)
 
+
+BULK_ID_RE = re.compile(rb"\d{15,20}")  # شناسه‌های دیسکورد در فایل آپلودی
+
+
+@bot.tree.command(name="bulkpay", description="افزودن یا کم کردن پول گروهی (admin فقط)")
+@app_commands.describe(amount="مقدار برای هر نفر", action="add یا rev",
+                       role="همه‌ی اعضای یک رول",
+                       channel="همه‌ی افراد حاضر در یک ویس",
+                       ids="فایل متنی شامل آیدی کاربران")
+async def bulkpay_cmd(interaction: discord.Interaction, amount: int, action: str,
+                      role: discord.Role = None,
+                      channel: discord.VoiceChannel = None,
+                      ids: discord.Attachment = None):
+    if not is_admin_member(interaction.user):
+        await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
+        return
+    action = action.lower()
+    if action not in ("add", "rev"):
+        await interaction.response.send_message("❌ پارامتر action باید `add` یا `rev` باشد.", ephemeral=True)
+        return
+    if amount <= 0 or not (role or channel or ids):
+        await interaction.response.send_message(
+            "❌ مقدار مثبت و حداقل یکی از role / channel / ids لازم است.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    targets = set()
+    skipped = 0
+    if role:
+        targets.update(m.id for m in role.members if not m.bot)
+    if channel:
+        targets.update(m.id for m in channel.members if not m.bot)
+    if ids:
+        try:
+            raw = await ids.read()
+        except discord.HTTPException:
+            await interaction.followup.send("❌ خواندن فایل ممکن نشد.", ephemeral=True)
+            return
+        # فقط اعضای فعلی سرور؛ آیدی اشتباه یا ربات ردیف خالی نمی‌سازد
+        for uid in {int(x) for x in BULK_ID_RE.findall(raw)} - targets:
+            member = interaction.guild.get_member(uid)
+            if member is not None and not member.bot:
+                targets.add(uid)
+            else:
+                skipped += 1
+    if not targets:
+        await interaction.followup.send("ℹ️ هیچ کاربری پیدا نشد.", ephemeral=True)
+        return
+
+    delta = amount if action == "add" else -amount
+    totals = await ledger.credit_many(sorted(targets), delta, "bulk")
+    verb = "اضافه شد" if action == "add" else "کم شد"
+    lines = [f"✅ {amount} سکه برای {len(totals)} کاربر {verb}."]
+    if skipped:
+        lines.append(f"⚠️ {skipped} آیدی نادیده گرفته شد (عضو سرور نیست یا ربات است).")
+    try:
+        await store.flush()
+    except Exception as e:
+        print("⚠️ bulkpay flush failed:", e)
+        lines.append("⚠️ ذخیره‌ی فوری ناموفق بود؛ در دور بعدی ذخیره‌سازی دوباره تلاش می‌شود.")
+    await interaction.followup.send("\n".join(lines), ephemeral=True)
+
 # -------------------------
 # وارن‌ها: /w (add/rev), /wr (reset), /wv (view)
 # -------------------------
@@ -1042,30 +3297,21 @@ async def w_cmd(interaction: discord.Interaction, member: discord.Member, count:
         await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
         return
 
-    uid = str(member.id)
+    uid = member.id
 
-    # ✅ خواندن داده از فایل
-    d = load_data()
-    warns = d.setdefault("warns", {})
-
-    current_warns = warns.get(uid, 0)
+    current_warns = store.get("warns", uid, 0)
 
     # ✅ افزودن یا کم کردن
     if action.lower() == "add":
-        current_warns += count
-        warns[uid] = current_warns
+        current_warns = store.set("warns", uid, current_warns + count)
         msg = f"⚠️ {count} وارن به {member.mention} اضافه شد. (تعداد فعلی: {current_warns})"
     elif action.lower() == "rev":
-        current_warns = max(0, current_warns - count)
-        warns[uid] = current_warns
+        current_warns = store.set("warns", uid, max(0, current_warns - count))
         msg = f"✅ {count} وارن از {member.mention} حذف شد. (تعداد فعلی: {current_warns})"
     else:
         await interaction.response.send_message("❌ پارامتر action باید `add` یا `rev` باشد.", ephemeral=True)
         return
 
-    # ✅ ذخیره در فایل
-    await save_data_async(d)
-
     # قوانین خودکار
     if current_warns >= 3 and current_warns < 5:
         try:
@@ -1095,11 +3341,8 @@ async def wr_cmd(interaction: discord.Interaction, member: discord.Member):
         await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
         return
 
-    uid = str(member.id)
-    d = load_data()
-    warns = d.setdefault("warns", {})
-    warns[uid] = 0
-    await save_data_async(d)
+    uid = member.id
+    store.set("warns", uid, 0)
 
     try:
         await member.edit(communication_disabled_until=None)
@@ -1119,10 +3362,8 @@ async def wv_cmd(interaction: discord.Interaction, member: discord.Member):
         await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
         return
 
-    uid = str(member.id)
-    d = load_data()
-    warns = d.get("warns", {})
-    count = warns.get(uid, 0)
+    uid = member.id
+    count = store.get("warns", uid, 0)
     await interaction.response.send_message(f"⚠️ {member.mention} دارای {count} وارن است.", ephemeral=True)
 
 # -------------------------
@@ -1138,9 +3379,9 @@ async def setgame_cmd(interaction: discord.Interaction,
         await interaction.response.send_message(
             "❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنند.", ephemeral=True)
         return
-    gid = str(interaction.guild_id)
-    server_settings.setdefault(gid, {})["game_channel_id"] = channel.id
-    await update_data()
+    gid = interaction.guild_id
+    store.set("server_settings", gid,
+              {**store.guild_settings(gid), "game_channel_id": channel.id})
     await interaction.response.send_message(
         f"✅ کانال مسابقات تنظیم شد: {channel.mention}")
 
@@ -1154,17 +3395,38 @@ async def setout_cmd(interaction: discord.Interaction,
         await interaction.response.send_message(
             "❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنند.", ephemeral=True)
         return
-    gid = str(interaction.guild_id)
-    server_settings.setdefault(gid, {})["result_channel_id"] = channel.id
-    await update_data()
+    gid = interaction.guild_id
+    store.set("server_settings", gid,
+              {**store.guild_settings(gid), "result_channel_id": channel.id})
     await interaction.response.send_message(
         f"✅ کانال نتایج تنظیم شد: {channel.mention}")
 
 
+# محدودیت تلاش برای هر کاربر در هر مسابقه
+CONTEST_MAX_ATTEMPTS = int(os.environ.get("CONTEST_MAX_ATTEMPTS", "5"))  # 0 = نامحدود
+CONTEST_ATTEMPT_COOLDOWN = int(os.environ.get("CONTEST_ATTEMPT_COOLDOWN", "30"))
+
+
+def contest_attempt_block(contest, uid, now):
+    """پیام خطا اگر کاربر فعلاً نمی‌تواند کد بفرستد، وگرنه None."""
+    attempt = contest.attempts.get(uid)
+    if not attempt:
+        return None
+    count, last_ts, won = attempt
+    if won:
+        return "✅ شما قبلاً کد درست را ثبت کرده‌اید."
+    if CONTEST_MAX_ATTEMPTS and count >= CONTEST_MAX_ATTEMPTS:
+        return f"❌ سقف {CONTEST_MAX_ATTEMPTS} تلاش شما برای این مسابقه پر شده است."
+    wait = last_ts + CONTEST_ATTEMPT_COOLDOWN - now
+    if wait > 0:
+        return f"⏳ لطفاً {wait} ثانیه دیگر دوباره تلاش کنید."
+    return None
+
+
 # Participation modal
 class ParticipationModal(Modal):
 
-    def __init__(self, contest_id: str):
+    def __init__(self, contest_id: int):
         super().__init__(title="شرکت در مسابقه")
         self.contest_id = contest_id
         self.code = TextInput(label="کد مخفی را وارد کنید",
@@ -1172,47 +3434,54 @@ class ParticipationModal(Modal):
         self.add_item(self.code)
 
     async def on_submit(self, interaction: discord.Interaction):
-        uid = str(interaction.user.id)
-        contest = contests.get(self.contest_id)
-        if not contest:
+        uid = interaction.user.id
+        contest = store.get("contests", self.contest_id)
+        if not contest or contest.settled or now_ts() >= contest.end_ts:
             await interaction.response.send_message(
                 "❌ این مسابقه دیگر معتبر نیست.", ephemeral=True)
             return
-        # ثبت ارسال
-        submissions = contest.setdefault("submissions", [])
-        submissions.append({
-            "user_id": uid,
-            "code": self.code.value.strip(),
-            "time": datetime.now(timezone.utc).isoformat()
-        })
-        await update_data()
+        now = now_ts()
+        block = contest_attempt_block(contest, uid, now)
+        if block:
+            await interaction.response.send_message(block, ephemeral=True)
+            return
+        # ثبت تلاش (فقط شمارنده، نه خود حدس)
+        code = self.code.value.strip()
+        attempt = contest.attempts.setdefault(uid, [0, 0, 0])
+        attempt[0] += 1
+        attempt[1] = now
         # پاسخ مختصر برای شرکت‌کننده
-        if self.code.value.strip() == contest.get("secret_code"):
-            # ثبت در winners (اگر قبلاً ثبت نشده)
-            winners = contest.setdefault("winners", [])
-            if not any(w.get("user_id") == uid for w in winners):
-                winners.append({
-                    "user_id": uid,
-                    "time": datetime.now(timezone.utc).isoformat()
-                })
-                await update_data()
+        if code == contest.secret_code:
+            attempt[2] = 1
+            contest.winners.append((uid, now))
+            store.touch("contests", self.contest_id)
             await interaction.response.send_message(
                 "✅ ممنون از شرکت شما! کد شما درست ثبت شد.", ephemeral=True)
         else:
+            store.touch("contests", self.contest_id)
             await interaction.response.send_message(
                 "❌ ممنون از شرکت شما. کد وارد شده درست نیست.", ephemeral=True)
 
 
 class ParticipateView(View):
+    """Persistent per contest: custom_id contest:participate:<id> (see resume_contests)."""
 
-    def __init__(self, contest_id: str):
+    def __init__(self, contest_id: int):
         super().__init__(timeout=None)
         self.contest_id = contest_id
-
-    @discord.ui.button(label="شرکت در مسابقه",
-                       style=discord.ButtonStyle.blurple)
-    async def participate(self, interaction: discord.Interaction,
-                          button: discord.ui.Button):
+        button = Button(label="شرکت در مسابقه",
+                        style=discord.ButtonStyle.blurple,
+                        custom_id=f"contest:participate:{contest_id}")
+        button.callback = self.participate
+        self.add_item(button)
+
+    async def participate(self, interaction: discord.Interaction):
+        contest = store.get("contests", self.contest_id)
+        block = contest and contest_attempt_block(contest, interaction.user.id,
+                                                  now_ts())
+        if block:
+            await interaction.response.send_message(block, ephemeral=True)
+            return
         modal = ParticipationModal(self.contest_id)
         await interaction.response.send_modal(modal)
 
@@ -1350,32 +3619,21 @@ async def plus_cmd(interaction: discord.Interaction):
         return
 
     # ساخت contest id یکتا
-    contest_id = str(random.randint(1000, 9999))
-    while contest_id in contests:
-        contest_id = str(random.randint(1000, 9999))
-
-    contest = {
-        "contest_id":
-        contest_id,
-        "creator_id":
-        str(interaction.user.id),
-        "image_url":
-        image_link,
-        "attachment_url":
-        image_msg.attachments[0].url if image_msg.attachments else None,
-        "secret_code":
-        secret_code,
-        "prize":
-        prize_amount,
-        "duration_type":
-        duration_holder['type'],
-        "duration_value":
-        duration_holder['value'],
-        "created_at":
-        datetime.now(timezone.utc).isoformat(),
-        "submissions": [],
-        "winners": []
-    }
+    contest_id = random.randint(1000, 9999)
+    while store.get("contests", contest_id):
+        contest_id = random.randint(1000, 9999)
+
+    contest = Contest(
+        contest_id=contest_id,
+        creator_id=interaction.user.id,
+        image_url=image_link,
+        attachment_url=image_msg.attachments[0].url
+        if image_msg.attachments else None,
+        secret_code=secret_code,
+        prize=prize_amount,
+        duration_type=duration_holder['type'],
+        duration_value=duration_holder['value'],
+        created_ts=now_ts())
 
     # پیش‌نمایش برای ادمین
     preview = discord.Embed(title=f"📣 پیش‌نمایش مسابقه #{contest_id}",
@@ -1384,13 +3642,13 @@ async def plus_cmd(interaction: discord.Interaction):
     preview.add_field(name="کد مخفی",
                       value=mask_code(secret_code),
                       inline=True)
-    if contest['duration_type'] == 'days':
+    if contest.duration_type == 'days':
         preview.add_field(name="مدت زمان",
-                          value=f"{contest['duration_value']} روز",
+                          value=f"{contest.duration_value} روز",
                           inline=True)
     else:
         preview.add_field(name="مدت زمان",
-                          value=f"{contest['duration_value']} ثانیه",
+                          value=f"{contest.duration_value} ثانیه",
                           inline=True)
     preview.add_field(name="لینک تصویر", value=image_link, inline=False)
     preview.add_field(name="جایزه (نفر اول)",
@@ -1399,8 +3657,8 @@ async def plus_cmd(interaction: discord.Interaction):
     preview.add_field(name="جایزه (نفر دوم)",
                       value=f"{prize_amount//2}",
                       inline=True)
-    if contest['image_url']:
-        preview.set_image(url=contest['image_url'])
+    if contest.image_url:
+        preview.set_image(url=contest.image_url)
 
     pv_view = View()
     register_btn = Button(label="ثبت مسابقه", style=discord.ButtonStyle.green)
@@ -1411,11 +3669,10 @@ async def plus_cmd(interaction: discord.Interaction):
             await btn_interaction.response.send_message(
                 "این دکمه برای سازنده مسابقه است.", ephemeral=True)
             return
-        contests[contest_id] = contest
-        await update_data()
+        store.set("contests", contest_id, contest)
 
-        gid = str(interaction.guild_id)
-        game_channel_id = server_settings.get(gid, {}).get("game_channel_id")
+        gid = interaction.guild_id
+        game_channel_id = store.guild_settings(gid).get("game_channel_id")
         if not game_channel_id:
             await btn_interaction.response.send_message(
                 "❌ کانال مسابقات تنظیم نشده است. از /setgame استفاده کنید.",
@@ -1427,39 +3684,15 @@ async def plus_cmd(interaction: discord.Interaction):
                 "❌ کانال مسابقات پیدا نشد.", ephemeral=True)
             return
 
-        embed = discord.Embed(
-            title=f"🏆 مسابقه شماره {contest_id}",
-            description="کد مخفی: ****** (برای شرکت کد را وارد کنید)",
-            color=discord.Color.blurple())
-        embed.add_field(name="تعداد شرکت‌کنندگان", value="0", inline=True)
-        if contest['duration_type'] == 'days':
-            embed.add_field(name="مدت زمان",
-                            value=f"{contest['duration_value']} روز",
-                            inline=True)
-        else:
-            embed.add_field(name="مدت زمان",
-                            value=f"{contest['duration_value']} ثانیه",
-                            inline=True)
-        embed.add_field(name="لینک تصویر",
-                        value=contest['image_url'],
-                        inline=False)
-        embed.add_field(name="جایزه (نفر اول)",
-                        value=f"{contest['prize']}",
-                        inline=True)
-        embed.add_field(name="جایزه (نفر دوم)",
-                        value=f"{contest['prize']//2}",
-                        inline=True)
-        if contest['image_url']:
-            embed.set_image(url=contest['image_url'])
         try:
-            msg = await game_channel.send(embed=embed,
+            msg = await game_channel.send(embed=contest_embed(contest),
                                           view=ParticipateView(contest_id))
-            contest['message_id'] = msg.id
-            contest['channel_id'] = game_channel.id
-            await update_data()
-            # start manage lifecycle task
-            task = bot.loop.create_task(manage_contest_lifecycle(contest_id))
-            active_contest_tasks[contest_id] = task
+            contest.message_id = msg.id
+            contest.channel_id = game_channel.id
+            store.touch("contests", contest_id)
+            # پایان با زمان‌بند؛ شمارنده با refresher
+            scheduler.schedule("contest_end", contest_id, contest.end_ts)
+            track_contest(contest, msg, sent=0)
             await btn_interaction.response.send_message(
                 "✅ مسابقه ثبت و ارسال شد.", ephemeral=True)
         except Exception as e:
@@ -1484,130 +3717,156 @@ async def plus_cmd(interaction: discord.Interaction):
                                     ephemeral=True)
 
 
-# lifecycle manager
-async def manage_contest_lifecycle(contest_id: str):
-    contest = contests.get(contest_id)
+# lifecycle: پایان با زمان‌بند (contest_end)، شمارنده با refresher
+def contest_embed(contest, count=0, finished=False):
+    embed = discord.Embed(
+        title=f"🏆 مسابقه شماره {contest.contest_id}",
+        description="کد مخفی: ****** (برای شرکت کد را وارد کنید)",
+        color=discord.Color.blurple())
+    embed.add_field(name="تعداد شرکت‌کنندگان", value=str(count), inline=True)
+    if contest.duration_type == 'days':
+        embed.add_field(name="مدت زمان",
+                        value=f"{contest.duration_value} روز",
+                        inline=True)
+    else:
+        embed.add_field(name="مدت زمان",
+                        value=f"{contest.duration_value} ثانیه",
+                        inline=True)
+    embed.add_field(name="لینک تصویر",
+                    value=contest.image_url,
+                    inline=False)
+    embed.add_field(name="جایزه (نفر اول)",
+                    value=f"{contest.prize}",
+                    inline=True)
+    embed.add_field(name="جایزه (نفر دوم)",
+                    value=f"{contest.prize//2}",
+                    inline=True)
+    if contest.image_url:
+        embed.set_image(url=contest.image_url)
+    if finished:
+        embed.add_field(name="وضعیت", value="پایان یافته", inline=False)
+    return embed
+
+
+def contest_message(contest):
+    channel = bot.get_channel(contest.channel_id) if contest.channel_id else None
+    if channel and contest.message_id:
+        return channel.get_partial_message(contest.message_id)
+    return None
+
+
+def track_contest(contest, message, sent=None):
+    # شمارنده فقط وقتی عوض شود ویرایش می‌شود
+    refresher.track(("contest", contest.contest_id), message,
+                    lambda: len(contest.attempts),
+                    lambda count: {"embed": contest_embed(contest, count)},
+                    contest.end_ts, sent=sent)
+
+
+def resume_contests():
+    """بعد از ری‌استارت: دکمه‌ی شرکت و شمارنده‌ی مسابقه‌های در جریان دوباره وصل می‌شوند."""
+    now = now_ts()
+    for cid, contest in store.section("contests").items():
+        if contest.settled or contest.end_ts <= now or not contest.message_id:
+            continue  # تسویه با کار contest_end
+        bot.add_view(ParticipateView(cid), message_id=contest.message_id)
+        message = contest_message(contest)
+        if message is not None and ("contest", cid) not in refresher.entries:
+            track_contest(contest, message)
+
+
+async def settle_contest(contest_id: int):
+    """تسویه‌ی مسابقه‌ی تمام‌شده؛ با ری‌استارت وسط کار دوباره پرداخت یا اعلام نمی‌کند."""
+    contest = store.get("contests", contest_id)
     if not contest:
         return
-    channel = bot.get_channel(contest.get("channel_id"))
-    message = None
-    try:
-        if channel and contest.get("message_id"):
-            message = await channel.fetch_message(contest["message_id"])
-    except Exception:
-        message = None
+    await refresher.untrack(("contest", contest_id))
+    channel = bot.get_channel(contest.channel_id) if contest.channel_id else None
+    message = contest_message(contest)
+
+    # contest ended -> winners به ترتیب اولین پاسخ درست ثبت شده‌اند
+    participants = len(contest.attempts)
+    first = contest.winners[0] if len(contest.winners) >= 1 else None
+    second = contest.winners[1] if len(contest.winners) >= 2 else None
+
+    # pay out: علامت settled و پرداخت زیر قفل برندگان و بدون await بین‌شان
+    async with ledger.hold(*(w[0] for w in contest.winners[:2])):
+        paid = not contest.settled
+        if paid:
+            contest.settled = True
+            store.touch("contests", contest_id)
+            if first:
+                store.add_balance(first[0], contest.prize, "contest")
+            if second:
+                store.add_balance(second[0], contest.prize // 2, "contest")
+    if paid:
+        try:
+            await store.flush()
+        except Exception as e:
+            print(f"⚠️ ذخیره‌ی تسویه‌ی مسابقه {contest_id}: {e}")
+
+    if not contest.announced:
+        # send result
+        gid = channel.guild.id if channel and channel.guild else None
+        result_channel_id = store.guild_settings(gid).get("result_channel_id")
+        result_channel = bot.get_channel(
+            result_channel_id) if result_channel_id else channel
+
+        res_embed = discord.Embed(title="🏁 نتیجه مسابقه",
+                                  color=discord.Color.gold())
+        res_embed.add_field(name="کد مسابقه", value=f"#{contest_id}", inline=False)
+        res_embed.add_field(name="کد مخفی مسابقه",
+                            value=contest.secret_code,
+                            inline=False)
+        res_embed.add_field(name="تعداد شرکت کنندگان",
+                            value=str(participants),
+                            inline=False)
+
+        winners_text = ""
+        if first:
+            u = bot.get_user(first[0])
+            winners_text += f"نفر اول: {u.mention if u else first[0]}\n"
+        else:
+            winners_text += "نفر اول: —\n"
+        if second:
+            u2 = bot.get_user(second[0])
+            winners_text += f"نفر دوم: {u2.mention if u2 else second[0]}\n"
+        else:
+            winners_text += "نفر دوم: —\n"
 
-    created = datetime.fromisoformat(contest["created_at"])
-    if contest["duration_type"] == "days":
-        end_time = created + timedelta(days=contest["duration_value"])
-    else:
-        end_time = created + timedelta(seconds=contest["duration_value"])
+        res_embed.add_field(name="برندگان", value=winners_text, inline=False)
+        res_embed.add_field(
+            name="میزان جایزه",
+            value=f"نفر اول: {contest.prize}\nنفر دوم: {contest.prize//2}",
+            inline=False)
+        res_embed.set_footer(text="ممنون از شرکت در مسابقه")
 
-    while True:
-        now = datetime.now(timezone.utc)
-        if now >= end_time:
-            break
-        # update participant count every 10 seconds
-        submissions = contest.get("submissions", [])
-        count = len(submissions)
+        try:
+            if result_channel:
+                await result_channel.send(embed=res_embed)
+            else:
+                # fallback
+                if channel:
+                    await channel.send(embed=res_embed)
+        except Exception:
+            pass
+
+        # mark message as finished
         if message:
             try:
-                embed = message.embeds[0]
-                new_embed = embed.copy()
-                # try find the participant field
-                found = False
-                for i, f in enumerate(new_embed.fields):
-                    if "تعداد شرکت" in f.name:
-                        new_embed.set_field_at(i,
-                                               name=f.name,
-                                               value=str(count),
-                                               inline=f.inline)
-                        found = True
-                        break
-                if not found:
-                    new_embed.add_field(name="تعداد شرکت‌کنندگان",
-                                        value=str(count),
-                                        inline=True)
-                await message.edit(embed=new_embed)
+                await message.edit(embed=contest_embed(contest, participants,
+                                                       finished=True),
+                                   view=None)
             except Exception:
                 pass
-        await asyncio.sleep(10)
-
-    # contest ended -> determine winners
-    submissions = contest.get("submissions", [])
-    correct = [
-        s for s in submissions if s.get("code") == contest.get("secret_code")
-    ]
-    first = correct[0] if len(correct) >= 1 else None
-    second = correct[1] if len(correct) >= 2 else None
-
-    # pay out
-    if first:
-        uid = first["user_id"]
-        user_wallet[uid] = user_wallet.get(uid, 0) + contest["prize"]
-    if second:
-        uid2 = second["user_id"]
-        user_wallet[uid2] = user_wallet.get(uid2, 0) + (contest["prize"] // 2)
-    await update_data()
-
-    # send result
-    gid = str(channel.guild.id) if channel and channel.guild else None
-    result_channel_id = server_settings.get(gid, {}).get("result_channel_id")
-    result_channel = bot.get_channel(
-        result_channel_id) if result_channel_id else channel
-
-    res_embed = discord.Embed(title="🏁 نتیجه مسابقه",
-                              color=discord.Color.gold())
-    res_embed.add_field(name="کد مسابقه", value=f"#{contest_id}", inline=False)
-    res_embed.add_field(name="کد مخفی مسابقه",
-                        value=contest.get("secret_code"),
-                        inline=False)
-    res_embed.add_field(name="تعداد شرکت کنندگان",
-                        value=str(len(submissions)),
-                        inline=False)
-
-    winners_text = ""
-    if first:
-        u = bot.get_user(int(first["user_id"]))
-        winners_text += f"نفر اول: {u.mention if u else first['user_id']}\n"
-    else:
-        winners_text += "نفر اول: —\n"
-    if second:
-        u2 = bot.get_user(int(second["user_id"]))
-        winners_text += f"نفر دوم: {u2.mention if u2 else second['user_id']}\n"
-    else:
-        winners_text += "نفر دوم: —\n"
-
-    res_embed.add_field(name="برندگان", value=winners_text, inline=False)
-    res_embed.add_field(
-        name="میزان جایزه",
-        value=f"نفر اول: {contest['prize']}\nنفر دوم: {contest['prize']//2}",
-        inline=False)
-    res_embed.set_footer(text="ممنون از شرکت در مسابقه")
+        contest.announced = True
+        store.touch("contests", contest_id)
 
+    # اگر بایگانی شکست بخورد مسابقه می‌ماند و بعداً (بدون ارسال دوباره) تکرار می‌شود
     try:
-        if result_channel:
-            await result_channel.send(embed=res_embed)
-        else:
-            # fallback
-            if channel:
-                await channel.send(embed=res_embed)
-    except Exception:
-        pass
-
-    # mark message as finished
-    if message:
-        try:
-            embed = message.embeds[0]
-            new_embed = embed.copy()
-            new_embed.add_field(name="وضعیت",
-                                value="پایان یافته",
-                                inline=False)
-            await message.edit(embed=new_embed, view=None)
-        except Exception:
-            pass
-
-    active_contest_tasks.pop(contest_id, None)
+        await archive_contest(contest_id)
+    except Exception as e:
+        print(f"⚠️ بایگانی مسابقه {contest_id}: {e}")
 
 
 # -------------------------
@@ -1621,52 +3880,126 @@ async def on_message(message: discord.Message):
     if message.author.bot:
         return
 
-    uid = str(message.author.id)
-    user_wallet[uid] = user_wallet.get(uid, 0) + 1
-    await update_data()
+    store.rewards.add(message.author.id, 1)
 
     await bot.process_commands(message)  # اجازه اجرای دستورات دیگر
 
 
-# بررسی و پاداش ری‌اکشن روی عکس/ویدیو
-async def reward_reaction(message: discord.Message):
-    if not message.attachments:
-        return
+# -------------------------
+# دفتر پاداش ری‌اکشن (بر اساس message id، پایدار)
+# -------------------------
+REACTIONS_PER_TIER = 10  # هر 10 ری‌اکشن
+REACTION_TIER_COINS = 1000  # = 1000 سکه
+REACTION_LEDGER_MAX = int(os.environ.get("REACTION_LEDGER_MAX", "20000"))
 
+
+def is_media_message(message: discord.Message) -> bool:
     # فقط تصاویر یا ویدیوها
-    if not any(
-            a.content_type and a.content_type.startswith(("image/", "video/"))
-            for a in message.attachments):
-        return
+    return any(
+        a.content_type and a.content_type.startswith(("image/", "video/"))
+        for a in message.attachments)
+
+
+class ReactionLedger:
+    """
+    data["reactions"]: message_id -> [author_id, reaction count, paid tiers].
+    Driven by raw reaction events, so it works for messages that are not in
+    the cache and survives restarts. A message is fetched once, the first
+    time it gets a reaction; after that only the counter moves.
+    The section doubles as the LRU: a touched entry is re-inserted at the
+    end and the oldest ones are dropped past REACTION_LEDGER_MAX.
+    data["reactions_floor"] is the newest evicted message id; a message at
+    or below it that comes back counts the tiers it already had as paid.
+    """
+
+    def __init__(self):
+        self.entries = store.section("reactions")
+        self.ignored = OrderedDict()  # پیام‌های غیر رسانه‌ای (فقط در حافظه)
+        self._loading = {}  # message_id -> task
+        self._queued = {}  # message_id -> جمع تغییرات رسیده در حین fetch
 
-    uid = str(message.author.id)
-    # تعداد کل ری‌اکشن روی پیام
-    total_reacts = sum(r.count for r in message.reactions)
-    # تعداد دفعاتی که قبلاً پول داده شده
-    last_rewarded = getattr(message, "rewarded_reacts", 0)
-    # هر 10 ری‌اکشن = 1000 سکه
-    new_rewards = (total_reacts // 10) - last_rewarded
+    async def _load(self, payload):
+        channel = bot.get_channel(payload.channel_id)
+        try:
+            message = await channel.fetch_message(payload.message_id)
+        except Exception:
+            return None
+        if message.author.bot or not is_media_message(message):
+            self.ignored[message.id] = None
+            if len(self.ignored) > REACTION_LEDGER_MAX:
+                self.ignored.popitem(last=False)
+            return None
+        # تعداد فعلی شامل همین ری‌اکشن هم هست؛ ری‌اکشن‌های خود ربات نه
+        return [message.author.id,
+                sum(r.count - r.me for r in message.reactions), 0]
+
+    async def _fetch(self, payload, delta):
+        mid = payload.message_id
+        if mid in self._loading:
+            # fetch در جریان است؛ تغییر بعد از رسیدن پیام اعمال می‌شود
+            self._queued[mid] = self._queued.get(mid, 0) + delta
+            return None
+        task = self._loading[mid] = asyncio.ensure_future(self._load(payload))
+        try:
+            entry = await task
+        finally:
+            self._loading.pop(mid, None)
+            queued = self._queued.pop(mid, 0)
+        if entry is not None:
+            if mid <= store.data["reactions_floor"]:
+                # شاید قبل از بیرون رفتن از دفتر پرداخت شده باشد
+                entry[2] = max(0, entry[1] - delta) // REACTIONS_PER_TIER
+            entry[1] = max(0, entry[1] + queued)
+        return entry
+
+    def _evict(self):
+        floor = store.data["reactions_floor"]
+        while len(self.entries) > REACTION_LEDGER_MAX:
+            mid = next(iter(self.entries))
+            store.pop("reactions", mid)
+            floor = max(floor, mid)
+        if floor != store.data["reactions_floor"]:
+            store.data["reactions_floor"] = floor
+            store.mark_dirty("data", "reactions_floor")
+
+    async def on_change(self, payload, delta):
+        mid = payload.message_id
+        if mid in self.ignored:
+            self.ignored.move_to_end(mid)
+            return
+        entry = self.entries.pop(mid, None)
+        if entry is None:
+            entry = await self._fetch(payload, delta)
+            if entry is None:
+                return
+        else:
+            entry[1] = max(0, entry[1] + delta)
+        tiers = entry[1] // REACTIONS_PER_TIER
+        coins = REACTION_TIER_COINS * max(0, tiers - entry[2])
+        entry[2] = max(entry[2], tiers)
+        store.set("reactions", mid, entry)  # انتهای LRU
+        self._evict()
+        if coins:
+            await ledger.credit(entry[0], coins, "reaction")
 
-    if new_rewards > 0:
-        user_wallet[uid] = user_wallet.get(uid, 0) + (1000 * new_rewards)
-        setattr(message, "rewarded_reacts", last_rewarded + new_rewards)
-        await update_data()
 
+reaction_ledger = ReactionLedger()
 
-# رویداد اضافه شدن ری‌اکشن
+
+# رویداد اضافه شدن ری‌اکشن (برای پیام‌های خارج از کش هم اجرا می‌شود)
 @bot.event
-async def on_reaction_add(reaction: discord.Reaction, user: discord.User):
-    if user.bot:
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    if payload.user_id == bot.user.id:
         return
-    await reward_reaction(reaction.message)
+    await reaction_ledger.on_change(payload, +1)
 
 
 # رویداد حذف ری‌اکشن
 @bot.event
-async def on_reaction_remove(reaction: discord.Reaction, user: discord.User):
-    if user.bot:
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    if payload.user_id == bot.user.id:
         return
-    await reward_reaction(reaction.message)
+    await reaction_ledger.on_change(payload, -1)
 
 
 # -------------------------
@@ -1674,13 +4007,13 @@ async def on_reaction_remove(reaction: discord.Reaction, user: discord.User):
 # -------------------------
 
 
-async def auto_ban_after_warn(uid: str, member: discord.Member):
+async def auto_ban_after_warn(uid: int, member: discord.Member):
     """
     بررسی تعداد وارن کاربر و بن خودکار بعد از رسیدن به 3 وارن.
-    uid: str شناسه کاربر
+    uid: int شناسه کاربر
     member: discord.Member شیء کاربر
     """
-    warns_count = user_warns.get(uid, 0)
+    warns_count = store.get("warns", uid, 0)
 
     if warns_count >= 3:
         try:
@@ -1711,8 +4044,7 @@ async def create_and_assign_custom_role(guild: discord.Guild,
     Create a role named '<lowername> ####' with no permissions, assign it to member,
     and save in data['shoprole'].
     """
-    global data
-    uid = str(member.id)
+    uid = member.id
     base = member.name.split("#")[0].lower()
     code = generate_4digits()
     role_name = f"{base} {code}"
@@ -1721,13 +4053,8 @@ async def create_and_assign_custom_role(guild: discord.Guild,
                                        permissions=discord.Permissions.none(),
                                        reason=f"Custom shop role for {uid}")
         # save
-        data_cache = load_data()
-        data.setdefault("shoprole", {})[uid] = {
-            "role_id": str(role.id),
-            "guild_id": str(guild.id),
-            "start_date": datetime.now(timezone.utc).isoformat()
-        }
-        await save_data_async(data)
+        entry = store.set("shoprole", uid, ShopRole(role.id, guild.id, now_ts()))
+        scheduler.schedule("shoprole", uid, entry.expires_ts)
         # give role
         try:
             await member.add_roles(role, reason="Bought custom shop role")
@@ -1751,20 +4078,18 @@ async def create_and_assign_custom_role(guild: discord.Guild,
 # -------------------------
 # حذف رول اختصاصی و پاکسازی از data.json
 # -------------------------
-async def remove_custom_role_for_user(uid: str):
-    global data, data_cache
+async def remove_custom_role_for_user(uid: int):
     try:
-        d = load_data()
-        entry = d.get("shoprole", {}).get(uid)
+        entry = store.get("shoprole", uid)
         if not entry:
             return
 
-        guild = bot.get_guild(int(entry["guild_id"]))
+        guild = bot.get_guild(entry.guild_id)
         if not guild:
             return
 
-        role = guild.get_role(int(entry["role_id"]))
-        member = guild.get_member(int(uid))
+        role = guild.get_role(entry.role_id)
+        member = guild.get_member(uid)
 
         if member and role and role in member.roles:
             try:
@@ -1778,14 +4103,9 @@ async def remove_custom_role_for_user(uid: str):
             except Exception as e:
                 print(f"[remove_custom_role_for_user] حذف رول از سرور: {e}")
 
-        # حذف از data و هماهنگ‌سازی کامل
-        if uid in d.get("shoprole", {}):
-            del d["shoprole"][uid]
-
-        # ذخیره و هماهنگ‌سازی حافظه
-        await save_data_async(d)
-        data = d
-        data_cache = d
+        # انتقال از data به بایگانی
+        await archive.put("subscriptions", uid, {"shoprole": entry})
+        store.pop("shoprole", uid)
 
         print(f"✅ shoprole برای {uid} حذف شد و فایل ذخیره شد.")
 
@@ -1799,67 +4119,196 @@ async def remove_custom_role_for_user(uid: str):
         print(f"⚠️ خطا در remove_custom_role_for_user: {e}")
 
 # -------------------------
-# بررسی اشتراک‌ها و رول‌ها هر ۱ دقیقه
+# زمان‌بند کارهای زمان‌دار (انقضای اشتراک، رول اختصاصی، بایگانی مسابقه)
 # -------------------------
-async def check_subscriptions_loop():
-    await bot.wait_until_ready()
-    while not bot.is_closed():
-        try:
-            global data_cache
-            data_cache = load_data()
-            now = datetime.now(timezone.utc)
-            updated = False
-
-            # 🕒 بررسی اشتراک معمولی
-            subs = data_cache.get("subscription", {})
-            expired_subs = []
-            for uid, start_date in list(subs.items()):
-                try:
-                    start = datetime.fromisoformat(start_date)
-                except Exception:
+SCHEDULER_RETRY = 60  # ثانیه؛ تلاش دوباره برای کار ناموفق
+
+
+class JobScheduler:
+    """
+    Durable one-shot jobs (kind, key) -> due epoch, persisted one entry per
+    job as data["scheduled_jobs"]["kind:key"] and kept in a min-heap. The runner sleeps until
+    the earliest due time (or indefinitely when empty) and is woken when an
+    earlier job is added. Rescheduling / cancelling leaves the old heap
+    entry behind; it is skipped when popped since it no longer matches.
+    Handlers re-check the record, so a stale job is always harmless.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.handlers = {}  # kind -> async fn(key)
+        self.jobs = {}
+        for job, due in store.data["scheduled_jobs"].items():
+            kind, _, key = job.partition(":")
+            self.jobs[(kind, int(key))] = due
+        self._heap = []
+        self._rebuild()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def handler(self, kind):
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def _rebuild(self):
+        self._heap = [(due, kind, key) for (kind, key), due in self.jobs.items()]
+        heapq.heapify(self._heap)
+
+    def _persist(self, kind, key):
+        due = self.jobs.get((kind, key))
+        if due is None:
+            self.store.pop("scheduled_jobs", f"{kind}:{key}")
+        else:
+            self.store.set("scheduled_jobs", f"{kind}:{key}", due)
+
+    def _persist_all(self):
+        self.store.data["scheduled_jobs"] = {
+            f"{kind}:{key}": due for (kind, key), due in self.jobs.items()
+        }
+        self.store.mark_dirty("data", "scheduled_jobs")
+
+    def schedule(self, kind, key, due, persist=True):
+        if self.jobs.get((kind, key)) == due:
+            return
+        self.jobs[(kind, key)] = due
+        heapq.heappush(self._heap, (due, kind, key))
+        if len(self._heap) > 2 * len(self.jobs) + 64:
+            self._rebuild()  # حذف ورودی‌های کهنه
+        if persist:
+            self._persist(kind, key)
+        if self._heap[0][0] == due:
+            self._wake.set()
+
+    def cancel(self, kind, key):
+        if self.jobs.pop((kind, key), None) is not None:
+            self._persist(kind, key)
+
+    def bootstrap(self):
+        """یک‌بار موقع شروع: هر رکورد زمان‌دار کار متناظرش را داشته باشد."""
+        for uid, sub in self.store.section("subscription").items():
+            self.schedule("subscription", uid, sub.expires_ts, persist=False)
+        for uid, entry in self.store.section("shoprole").items():
+            self.schedule("shoprole", uid, entry.expires_ts, persist=False)
+        for cid, contest in self.store.section("contests").items():
+            # مسابقه‌هایی که در زمان خاموشی تمام شده‌اند بلافاصله تسویه می‌شوند
+            self.schedule("contest_end", cid, contest.end_ts, persist=False)
+        now = now_ts()
+        for uid, timer in self.store.section("timers").items():
+            if not timer.warned and timer.end_ts <= now:
+                # در زمان خاموشی تمام شده؛ هشدار دیگر معنی ندارد
+                timer.warned = True
+                self.store.touch("timers", uid)
+            elif not timer.warned:
+                self.schedule("timer_warning", uid, timer.end_ts - 4 * DAY,
+                              persist=False)
+        self._persist_all()
+
+    def _pop_due(self, now):
+        due_jobs = []
+        while self._heap and self._heap[0][0] <= now:
+            due, kind, key = heapq.heappop(self._heap)
+            if self.jobs.get((kind, key)) == due:
+                del self.jobs[(kind, key)]
+                self._persist(kind, key)
+                due_jobs.append((kind, key))
+        return due_jobs
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self.bootstrap()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        await bot.wait_until_ready()
+        while True:
+            self._wake.clear()
+            for kind, key in self._pop_due(now_ts()):
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    print(f"⚠️ unknown job kind {kind}:{key}; dropped")
                     continue
-                if now - start >= timedelta(days=30):
-                    expired_subs.append(uid)
-
-            for uid in expired_subs:
-                subs.pop(uid, None)
-                updated = True
-                for guild in bot.guilds:
-                    member = guild.get_member(int(uid))
-                    if member:
-                        role = discord.utils.get(guild.roles, name="sub (1)")
-                        if role and role in member.roles:
-                            await member.remove_roles(role, reason="Subscription expired")
-                        try:
-                            await member.send("⏳ اشتراک معمولی شما منقضی شد.")
-                        except:
-                            pass
-
-            # 🕒 بررسی رول اختصاصی
-            shoprole = data_cache.get("shoprole", {})
-            expired_roles = []
-            for uid, info in list(shoprole.items()):
                 try:
-                    start = datetime.fromisoformat(info["start_date"])
-                except Exception:
-                    continue
-                if now - start >= timedelta(days=30):
-                    expired_roles.append(uid)
+                    await handler(key)
+                except Exception as e:
+                    print(f"⚠️ job {kind}:{key} failed:", e)
+                    self.schedule(kind, key, now_ts() + SCHEDULER_RETRY)
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is not None and timeout <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
 
-            for uid in expired_roles:
-                await remove_custom_role_for_user(uid)
-                updated = True
 
-            if updated:
-                await save_data_async(data_cache)
-                print("✅ داده‌ها به‌روزرسانی و ذخیره شدند.")
+scheduler = JobScheduler(store)
 
-        except Exception as e:
-            print("⚠️ Error in check_subscriptions_loop:", e)
-        
-        data = data_cache
 
-        await asyncio.sleep(60)
+@scheduler.handler("subscription")
+async def expire_subscription(uid: int):
+    sub = store.get("subscription", uid)
+    if not sub:
+        return
+    if sub.expires_ts > now_ts():
+        # تمدید شده ولی کارش ثبت نشده بود
+        scheduler.schedule("subscription", uid, sub.expires_ts)
+        return
+    await archive.put("subscriptions", uid, {"subscription": sub})
+    store.pop("subscription", uid)
+    for guild in bot.guilds:
+        member = guild.get_member(uid)
+        if member:
+            role = discord.utils.get(guild.roles, name="sub (1)")
+            if role and role in member.roles:
+                await member.remove_roles(role, reason="Subscription expired")
+            try:
+                await member.send("⏳ اشتراک معمولی شما منقضی شد.")
+            except:
+                pass
+
+
+@scheduler.handler("shoprole")
+async def expire_shoprole(uid: int):
+    entry = store.get("shoprole", uid)
+    if not entry:
+        return
+    if entry.expires_ts > now_ts():
+        scheduler.schedule("shoprole", uid, entry.expires_ts)
+        return
+    await remove_custom_role_for_user(uid)
+    if store.get("shoprole", uid):
+        # حذف انجام نشد (مثلاً سرور در دسترس نبود)؛ بعداً دوباره
+        scheduler.schedule("shoprole", uid, now_ts() + 3600)
+
+
+@scheduler.handler("timer_warning")
+async def warn_timer(uid: int):
+    timer = store.get("timers", uid)
+    if not timer or timer.warned:
+        return
+    remaining = timer.end_ts - now_ts()
+    channel = bot.get_channel(timer.channel_id)
+    if channel and remaining > 0:
+        # بعد از خاموشی ممکن است کمتر از ۳ روز مانده باشد
+        days, hours = remaining // DAY, remaining % DAY // 3600
+        left = f"{days} روز و {hours} ساعت" if days else f"{hours} ساعت"
+        await channel.send(f"⚠️ فقط {left} باقی مانده برای <@{uid}>!")
+    timer.warned = True
+    store.touch("timers", uid)
+
+
+@scheduler.handler("contest_end")
+@scheduler.handler("contest_archive")  # کارهای ذخیره‌شده از نسخه‌ی قبل
+async def end_contest_job(contest_id: int):
+    contest = store.get("contests", contest_id)
+    if not contest:
+        return
+    if contest.end_ts > now_ts():
+        scheduler.schedule("contest_end", contest_id, contest.end_ts)
+        return
+    await settle_contest(contest_id)
 # -------------------------
 # Shop UI and flows
 # -------------------------
@@ -1876,20 +4325,17 @@ class ConfirmBuyView(View):
 
     @discord.ui.button(label="✅ بله", style=discord.ButtonStyle.green)
     async def confirm(self, interaction: Interaction, button: Button):
-        uid = str(interaction.user.id)
-        d = load_data()
-        wallets = d.setdefault("wallet", {})
-        bal = wallets.get(uid, 0)
-        if bal < self.price:
-            await interaction.response.send_message("❌ موجودی شما کافی نیست.",
-                                                    ephemeral=True)
-            return
-        wallets[uid] = bal - self.price
-        d["wallet"] = wallets
+        await respond_once(interaction, "buy",
+                           lambda: self._purchase(interaction))
+
+    async def _purchase(self, interaction: Interaction):
+        uid = interaction.user.id
+        if not await ledger.debit_if_sufficient(uid, self.price, "shop"):
+            return "❌ موجودی شما کافی نیست."
         # perform purchase
         if self.product_name == "اشتراک 1 ماهه":
-            d.setdefault("subscription",
-                         {})[uid] = datetime.now(timezone.utc).isoformat()
+            sub = store.set("subscription", uid, Subscription(now_ts()))
+            scheduler.schedule("subscription", uid, sub.expires_ts)
             # give role if exists
             role = discord.utils.get(interaction.guild.roles, name="sub (1)")
             if role:
@@ -1903,21 +4349,15 @@ class ConfirmBuyView(View):
             role = await create_and_assign_custom_role(interaction.guild,
                                                        interaction.user)
             if role:
-                d.setdefault("shoprole", {})[str(interaction.user.id)] = {
-                    "guild_id": str(interaction.guild.id),
-                    "role_id": str(role.id),
-                    "start_date": datetime.now(timezone.utc).isoformat()
-                }
+                # create_and_assign_custom_role خودش shoprole را ثبت می‌کند
                 resp = f"🎖 رول اختصاصی `{role.name}` ساخته و به شما داده شد!"
             else:
+                await ledger.credit(uid, self.price, "refund")
                 resp = "❌ خطا در ساخت رول اختصاصی."
         else:
             resp = "✅ خرید ثبت شد."
 
-        await save_data_async(d)
-        await interaction.response.send_message(
-            f"{resp}\n💰 موجودی جدید: `{d.get('wallet', {}).get(uid,0)}`",
-            ephemeral=True)
+        return f"{resp}\n💰 موجودی جدید: `{store.balance(uid)}`"
 
     @discord.ui.button(label="❌ نه", style=discord.ButtonStyle.red)
     async def cancel(self, interaction: Interaction, button: Button):
@@ -2012,19 +4452,14 @@ class ConfirmOrderView(View):
 
     @discord.ui.button(label="آره", style=discord.ButtonStyle.green)
     async def yes_cb(self, interaction: Interaction, button: Button):
-        d = load_data()
-        wallets = d.setdefault("wallet", {})
-        uid = str(interaction.user.id)
-        bal = wallets.get(uid, 0)
+        await respond_once(interaction, "order",
+                           lambda: self._order(interaction))
 
-        if bal < self.price:
-            await interaction.response.send_message(
-                "❌ موجودی کافی برای این سفارش وجود ندارد.", ephemeral=True)
-            return
+    async def _order(self, interaction: Interaction):
+        uid = interaction.user.id
 
-        wallets[uid] = bal - self.price
-        d["wallet"] = wallets
-        await save_data_async(d)
+        if not await ledger.debit_if_sufficient(uid, self.price, "order"):
+            return "❌ موجودی کافی برای این سفارش وجود ندارد."
 
         # فقط ارسال به ادمین‌ها، بدون ذخیره در data.json
         if interaction.guild:
@@ -2039,8 +4474,7 @@ class ConfirmOrderView(View):
                     except Exception:
                         pass
 
-        await interaction.response.send_message(
-            "✅ سفارش ثبت شد و به ادمین‌ها اطلاع داده شد.", ephemeral=True)
+        return "✅ سفارش ثبت شد و به ادمین‌ها اطلاع داده شد."
 
     @discord.ui.button(label="نه", style=discord.ButtonStyle.red)
     async def no_cb(self, interaction: Interaction, button: Button):
@@ -2071,10 +4505,8 @@ class ShopSelect(Select):
 
     async def callback(self, interaction: Interaction):
         choice = self.values[0]
-        uid = str(interaction.user.id)
-        d = load_data()
-        wallets = d.setdefault("wallet", {})
-        balance = wallets.get(uid, 0)
+        uid = interaction.user.id
+        balance = store.balance(uid)
         prices = {"اشتراک 1 ماهه": PRICE_SUB, "رول اختصاصی": PRICE_ROLE_CUSTOM}
         if choice == "سفارشات خاص":
             await interaction.response.send_message(
@@ -2135,68 +4567,44 @@ class RenewButton(Button):
         self.kind = kind
 
     async def callback(self, interaction: Interaction):
-        uid = str(interaction.user.id)
-        d = load_data()
-        wallets = d.setdefault("wallet", {})
-        bal = wallets.get(uid, 0)
-
-        # بررسی موجودی
-        if bal < self.cost:
-            await interaction.response.send_message(
-                "❌ موجودی کافی برای تمدید وجود ندارد.", ephemeral=True)
-            return
+        await respond_once(interaction, f"renew:{self.kind}",
+                           lambda: self._renew(interaction))
 
-        # کم کردن پول از حساب
-        wallets[uid] = bal - self.cost
+    async def _renew(self, interaction: Interaction):
+        uid = interaction.user.id
 
         # بررسی نوع تمدید (اشتراک معمولی)
         if self.kind == "sub":
-            d.setdefault("subscription",
-                         {})[uid] = datetime.now(timezone.utc).isoformat()
-            await save_data_async(d)
-            await interaction.response.send_message("✅ اشتراک شما تمدید شد.",
-                                                    ephemeral=True)
-            return
+            if not await ledger.debit_if_sufficient(uid, self.cost, "renew"):
+                return "❌ موجودی کافی برای تمدید وجود ندارد."
+            sub = store.set("subscription", uid, Subscription(now_ts()))
+            scheduler.schedule("subscription", uid, sub.expires_ts)
+            return "✅ اشتراک شما تمدید شد."
 
         # بررسی نوع تمدید (رول اختصاصی)
         elif self.kind == "shoprole":
-            shoprole = d.setdefault("shoprole", {})
-            key = str(uid)
-            if key not in shoprole:
-                await interaction.response.send_message(
-                    "❌ شما رول اختصاصی فعال ندارید.", ephemeral=True)
-                return
-
-    # بروزرسانی تاریخ شروع اشتراک رول اختصاصی
-            shoprole[key]["start_date"] = datetime.now(
-                timezone.utc).isoformat()
-
-            # ثبت تغییر در دیکشنری اصلی
-            d["shoprole"] = shoprole
+            entry = store.get("shoprole", uid)
+            if not entry:
+                return "❌ شما رول اختصاصی فعال ندارید."
 
-            # ذخیره در فایل data.json
-            await save_data_async(d)
+            if not await ledger.debit_if_sufficient(uid, self.cost, "renew"):
+                return "❌ موجودی کافی برای تمدید وجود ندارد."
+            # بروزرسانی تاریخ شروع اشتراک رول اختصاصی
+            entry.start_ts = now_ts()
+            store.touch("shoprole", uid)
+            scheduler.schedule("shoprole", uid, entry.expires_ts)
+            print(f"✅ تاریخ جدید رول اختصاصی برای {uid}: {entry.start_ts}")
 
-            # بررسی دوباره بعد از ذخیره
-            check = load_data()
-            print(
-                f"✅ تاریخ جدید رول اختصاصی برای {key}: {check['shoprole'][key]['start_date']}"
-            )
-
-            await interaction.response.send_message(
-                "✅ رول اختصاصی شما تمدید شد و در فایل ذخیره شد.",
-                ephemeral=True)
-            return
+            return "✅ رول اختصاصی شما تمدید شد و در فایل ذخیره شد."
+        return "❌ نوع تمدید نامعتبر است."
 
 
 @bot.tree.command(name="tam", description="نمایش اشتراک‌ها و تمدید آنها")
 async def tam_cmd(interaction: Interaction):
-    uid = str(interaction.user.id)
-    d = load_data()
-    wallets = d.get("wallet", {})
-    bal = wallets.get(uid, 0)
-    subs = d.get("subscription", {})
-    shoprole = d.get("shoprole", {})
+    uid = interaction.user.id
+    bal = store.balance(uid)
+    sub = store.get("subscription", uid)
+    role_info = store.get("shoprole", uid)
 
     embed = discord.Embed(title="📋 وضعیت اشتراک‌ها",
                           color=discord.Color.blue())
@@ -2205,12 +4613,10 @@ async def tam_cmd(interaction: Interaction):
     # وضعیت اشتراک معمولی
     sub_status = "❌ ندارد"
     has_sub = False
-    if uid in subs:
-        start = datetime.fromisoformat(subs[uid])
-        end = start + timedelta(days=30)
-        remain = end - datetime.now(timezone.utc)
-        if remain.total_seconds() > 0:
-            sub_status = f"✅ فعال — {remain.days} روز مانده"
+    if sub:
+        remain = sub.expires_ts - now_ts()
+        if remain > 0:
+            sub_status = f"✅ فعال — {remain // DAY} روز مانده"
             has_sub = True
         else:
             sub_status = "⛔ منقضی شده"
@@ -2219,13 +4625,10 @@ async def tam_cmd(interaction: Interaction):
     # وضعیت رول اختصاصی
     shop_status = "❌ ندارد"
     has_role = False
-    if uid in shoprole:
-        info = shoprole[uid]
-        start = datetime.fromisoformat(info["start_date"])
-        end = start + timedelta(days=30)
-        remain = end - datetime.now(timezone.utc)
-        if remain.total_seconds() > 0:
-            shop_status = f"✅ رول اختصاصی فعال — {remain.days} روز مانده"
+    if role_info:
+        remain = role_info.expires_ts - now_ts()
+        if remain > 0:
+            shop_status = f"✅ رول اختصاصی فعال — {remain // DAY} روز مانده"
             has_role = True
         else:
             shop_status = "⛔ منقضی شده"
@@ -2252,12 +4655,54 @@ async def tam_cmd(interaction: Interaction):
                                             ephemeral=True)
 
 
+# -------------------------
+# /archive (مشاهده‌ی بایگانی، admin فقط)
+# -------------------------
+ARCHIVE_KINDS = {"contest": "contests", "sub": "subscriptions", "member": "members"}
+
+
+def format_archived(kind, rec):
+    at = datetime.fromtimestamp(rec["at"], timezone.utc).strftime("%Y-%m-%d %H:%M")
+    value = rec["v"]
+    if kind == "contests":
+        winners = "، ".join(f"<@{w[0]}>" for w in value["winners"]) or "—"
+        body = (f"کد مخفی: {value['secret_code']} | جایزه: {value['prize']} | "
+                f"شرکت‌کنندگان: {len(value.get('attempts') or value.get('submissions') or [])}"
+                f" | برندگان: {winners}")
+    else:
+        body = json.dumps(value, ensure_ascii=False)
+    return f"🗄 `{at}` — {body}"
+
+
+@bot.tree.command(name="archive", description="جستجو در بایگانی (admin فقط)")
+@app_commands.describe(kind="contest / sub / member", key="شماره مسابقه یا ID کاربر")
+async def archive_cmd(interaction: discord.Interaction, kind: str, key: str):
+    if not is_admin_member(interaction.user):
+        await interaction.response.send_message("❌ فقط ادمین‌ها می‌تونن این فرمان رو اجرا کنن.", ephemeral=True)
+        return
+    section = ARCHIVE_KINDS.get(kind.lower())
+    if not section or not key.strip().isdigit():
+        await interaction.response.send_message(
+            "❌ kind باید contest / sub / member و key یک عدد باشد.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    records = await archive.find(section, int(key))
+    if not records:
+        await interaction.followup.send("🔍 چیزی در بایگانی پیدا نشد.", ephemeral=True)
+        return
+    lines = [format_archived(section, rec) for rec in records[-5:]]
+    await interaction.followup.send("\n".join(lines)[:1900], ephemeral=True)
+
+
 # -------------------------
 # basic on_ready and events
 # -------------------------
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user} (id: {bot.user.id})")
+    voice_tracker.bootstrap(bot.guilds)
+    resume_timers()
+    resume_contests()
     try:
         await bot.tree.sync()
         print("✅ Tree synced")
@@ -2267,21 +4712,34 @@ async def on_ready():
 
 @bot.event
 async def on_member_remove(member: discord.Member):
-    # clean wallet, subscription, badges, shoprole etc
-    uid = str(member.id)
-    d = load_data()
-    d.get("wallet", {}).pop(uid, None)
-    d.get("subscription", {}).pop(uid, None)
-    d.get("warns", {}).pop(uid, None)
-    d.get("badges", {}).pop(uid, None)
+    # clean wallet, subscription, badges, shoprole etc (به بایگانی منتقل می‌شوند)
+    uid = member.id
+    # قفل کیف پول تا پرداختی بین بایگانی و حذف گم نشود
+    async with ledger.hold(uid):
+        if uid in store.rewards.pending:
+            store.add_balance(uid, 0)  # ثبت پاداش‌های در صف
+        removed = {}
+        for section in ("wallet", "subscription", "warns", "badges", "shoprole",
+                        "history", "last_active"):
+            value = store.get(section, uid)
+            if value is not None:
+                removed[section] = value
+        if removed:
+            await archive.put("members", uid, removed)
+        for section in removed:
+            store.pop(section, uid)
+        if removed.get("wallet"):
+            # سکه‌های کاربر خارج‌شده از گردش خارج می‌شوند
+            store.telemetry.observe(-removed["wallet"], "leave", now_ts())
+    scheduler.cancel("subscription", uid)
+    scheduler.cancel("shoprole", uid)
     # remove shoprole if any
-    shop = d.get("shoprole", {})
-    if uid in shop:
-        entry = shop.pop(uid)
+    entry = removed.get("shoprole")
+    if entry:
         try:
-            g = bot.get_guild(int(entry.get("guild_id")))
+            g = bot.get_guild(entry.guild_id)
             if g:
-                role = g.get_role(int(entry.get("role_id")))
+                role = g.get_role(entry.role_id)
                 if role:
                     try:
                         await role.delete(
@@ -2290,26 +4748,26 @@ async def on_member_remove(member: discord.Member):
                         pass
         except Exception:
             pass
-    await save_data_async(d)
 
 
 @bot.event
 async def on_message(message: discord.Message):
     if message.author.bot:
         return
-    # give 1 coin per message
-    uid = str(message.author.id)
-    d = load_data()
-    wallets = d.setdefault("wallet", {})
-    wallets[uid] = wallets.get(uid, 0) + 1
-    await save_data_async(d)
+    # give 1 coin per message (جمع می‌شود و دسته‌ای ثبت می‌شود)
+    store.rewards.add(message.author.id, 1)
     await bot.process_commands(message)
 
 
 @bot.event
 async def setup_hook():
-    # اجرای تسک چک اشتراک‌ها پس از آماده شدن ربات
-    bot.loop.create_task(check_subscriptions_loop())
+    # اجرای تسک ذخیره‌سازی تأخیری و بکاپ دوره‌ای
+    store.start()
+    store.rewards.start()
+    backups.start()
+    economy.start()
+    # زمان‌بند انقضای اشتراک‌ها، رول‌ها و بایگانی مسابقات
+    scheduler.start()
 
 
 # -------------------------
@@ -2317,6 +4775,25 @@ async def setup_hook():
 # -------------------------
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["import-sqlite"]:
+        # python main.py import-sqlite [bot.db]
+        counts = import_json_to_sqlite(*sys.argv[2:3])
+        print("✅ JSON -> SQLite:", counts)
+        sys.exit(0)
+    if sys.argv[1:2] == ["restore"]:
+        # python main.py restore <snapshot>   (بدون نام: فهرست بکاپ‌ها)
+        if len(sys.argv) < 3:
+            for *_, name in backups.snapshots():
+                print(name)
+            sys.exit(0)
+        counts = restore_backup(os.path.basename(sys.argv[2]))
+        print(f"✅ {DATA_FILE} / {STREAM_FILE} بازسازی شدند:", counts)
+        if STORAGE_BACKEND == "sqlite":
+            print("ℹ️ حالا python main.py import-sqlite را اجرا کنید.")
+        elif STORAGE_BACKEND in ("journal", "sections"):
+            print("ℹ️ پوشه‌ی", JOURNAL_DIR if STORAGE_BACKEND == "journal"
+                  else STATE_DIR, "را کنار بگذارید تا از فایل‌های JSON دوباره ساخته شود.")
+        sys.exit(0)
     try:
         bot.run(TOKEN)
     except Exception as e: